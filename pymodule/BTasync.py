@@ -0,0 +1,63 @@
+"""
+Shared pool of worker processes used by init_mesh_async to run the harmonic searches in the background.
+Only the null space solver runs in a worker (null_space_job of BTnullspace, which does not import dolfin) : the operator is sent as its CSR arrays
+and the basis come back as a numpy array (Search_result),
+the assembly and the construction of the basis stay in the calling process. A process is used rather than a thread as PETSc (and dolfin above it)
+is not thread safe and the solvers mostly hold the GIL, the workers are started with "spawn" so that they do not inherit the MPI state of the caller.
+The futures can be awaited from asyncio with asyncio.wrap_future.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, Future
+import multiprocessing
+import os
+import numpy as np
+
+executor = None
+
+def set_worker_budget(n):
+    """
+    Set the number of harmonic searches allowed to run at the same time (the previous pool finish its pending work).
+    Remember that each search may also use several BLAS threads (see OPENBLAS_NUM_THREADS).
+    """
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=False)
+    executor = ProcessPoolExecutor(max_workers=n,mp_context=multiprocessing.get_context("spawn"))
+
+def get_executor(custom=None):
+    if custom is not None:
+        return custom
+    if executor is None:
+        set_worker_budget(max(1,(os.cpu_count() or 2)//2))
+    return executor
+
+def completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+class Search_result:
+    """
+    Picklable copy of the result of a null space solver (same interface : Get_Dim, Get_Confidence, Get_Vector).
+    """
+    def __init__(self,Solver):
+        self.n = Solver.Get_Dim()
+        self.confidence = Solver.Get_Confidence()
+        self.vectors = [np.array(Solver.Get_Vector(i),dtype=np.float64) for i in range(self.n)]
+    def Get_Dim(self):
+        return self.n
+    def Get_Confidence(self):
+        return self.confidence
+    def Get_Vector(self,i,out=None):
+        if out is not None:
+            out.set_local(self.vectors[i])
+            out.apply("insert")
+            return out
+        return self.vectors[i]
+
+def init_meshes_async(solvers,meshes,**kwargs):
+    """
+    Start the initialisation of each solver on the corresponding mesh, kwargs are passed to init_mesh_async.
+    Return the list of futures, at most the worker budget searches run at the same time.
+    """
+    return [solver.init_mesh_async(mesh,**kwargs) for (solver,mesh) in zip(solvers,meshes)]
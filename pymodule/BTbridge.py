@@ -0,0 +1,83 @@
+"""
+Single conversion point between the PETSc matrix assembled for the harmonic search and the scipy based null space solvers.
+The matrix is converted once (petsc4py does not expose the AIJ arrays without a copy) and the PETSc matrix is released as soon as scipy hold it,
+so that at most one copy of the operator is alive. The solvers write their vectors directly in dolfin vectors (Get_Vector(i,out)).
+peak_memory() report the peak resident memory of the process, the search print it before and after itself with Tunning["memory_report"] == True.
+"""
+
+import numpy as np
+import resource
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import LinearOperator
+from petsc4py import PETSc
+try:
+    import pyamg
+except ImportError:
+    pyamg = None
+
+class Sparse_operator:
+    """
+    mat is a PETSc matrix, or None when matrix (scipy CSR) is given.
+    """
+    def __init__(self,mat,matrix=None):
+        self.mat = mat
+        self.matrix = matrix
+        self.shape = tuple(mat.size) if mat is not None else matrix.shape
+
+    def petsc(self):
+        if self.mat is None:
+            # only happen when csr() was called first
+            A = self.matrix
+            self.mat = PETSc.Mat().createAIJWithArrays(self.shape,(A.indptr.astype(PETSc.IntType),A.indices.astype(PETSc.IntType),A.data))
+        return self.mat
+
+    def csr(self,release=True):
+        if self.matrix is None:
+            (ai,aj,av) = self.mat.getValuesCSR()
+            self.matrix = csr_matrix((av,aj,ai),shape=self.shape,copy=False)
+            if (release):
+                self.mat = None
+        return self.matrix
+
+def as_operator(mat):
+    if isinstance(mat,Sparse_operator):
+        return mat
+    return Sparse_operator(mat)
+
+def write_vector(values,out):
+    out.set_local(values)
+    out.apply("insert")
+    return out
+
+def peak_memory():
+    """
+    Peak resident memory of the process in MB (Linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+def amg_preconditioner(B,kind=None):
+    """
+    Return a LinearOperator applying one AMG cycle for the symmetric positive semi-definite scipy matrix B.
+    kind is "pyamg" (smoothed aggregation) or "gamg" (PETSc), by default pyamg when it is installed.
+    """
+    if kind is None:
+        kind = "gamg" if pyamg is None else "pyamg"
+    B = B.tocsr()
+    if (kind == "pyamg"):
+        return pyamg.smoothed_aggregation_solver(B).aspreconditioner()
+    mat = PETSc.Mat().createAIJWithArrays(B.shape,(B.indptr.astype(PETSc.IntType),B.indices.astype(PETSc.IntType),B.data))
+    ksp = PETSc.KSP().create()
+    ksp.setOperators(mat)
+    ksp.setType('preonly')
+    ksp.getPC().setType('gamg')
+    ksp.setUp()
+    (x,y) = mat.createVecs()
+    def apply(v):
+        out = np.empty(B.shape[0])
+        x.placeArray(np.ascontiguousarray(v,dtype=np.float64).ravel())
+        y.placeArray(out)
+        ksp.solve(x,y)
+        x.resetArray()
+        y.resetArray()
+        return out
+    return LinearOperator(B.shape,matvec=apply,dtype=np.float64)
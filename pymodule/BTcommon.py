@@ -0,0 +1,39 @@
+"""
+Helpers shared by BTsolver_2D and BTsolver_3D that need dolfin (the null space solvers, which do not, are in BTnullspace).
+"""
+
+from dolfin import *
+import numpy as np
+from BTbridge import Sparse_operator
+
+def lowest_order_elements(Elemdict):
+    return {key : {'form' : 'trimmed', 'degree' : 1} for key in Elemdict}
+
+def assemble_harmonic_search(base,mesh,DBC=False,Elemdict=None,Tunning={},context=None):
+    """
+    base is the BiotSavart_base of the dimension, return (biot_savart_solver,Sparse_operator) ready for null_space_solver.
+    """
+    if Elemdict is not None:
+        biot_savart_solver = base(DBC,Elemdict=Elemdict,Tunning=Tunning)
+    else:
+        biot_savart_solver = base(DBC,Tunning=Tunning)
+    A = biot_savart_solver.init(mesh,context=context)
+    print("system size : ",(A.size(0),A.size(1)))
+    # the bridge hold the only reference to the matrix, it is released once converted
+    return (biot_savart_solver,Sparse_operator(as_backend_type(A).mat()))
+
+def dorfler_marking(mesh,eta,theta=0.5):
+    """
+    Mark the smallest set of cells whose squared indicators eta (one per cell, as returned by estimate_error) sum to at least theta times the total.
+    In parallel each process mark its own cells.
+    Return a MeshFunction usable with refine(mesh,markers).
+    """
+    markers = MeshFunction("bool", mesh, mesh.topology().dim(), False)
+    order = np.argsort(eta)[::-1]
+    cumulative = np.cumsum(eta[order])
+    nmarked = min(np.searchsorted(cumulative, theta*cumulative[-1]) + 1, len(order))
+    markers.array()[order[:nmarked]] = True
+    return markers
+
+def boundary_whole(x, on_boundary):
+    return on_boundary
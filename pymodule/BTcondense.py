@@ -0,0 +1,116 @@
+"""
+Static condensation of the cell interior dofs of the mixed operator.
+The dofs attached to the cells (all the dofs of the top forms and the bubbles of the other forms at higher degree) only couple with the dofs of their cell
+and with the Real dofs, they are eliminated cell by cell with batched dense solves and the remaining (skeleton) system is factorized.
+The Real dofs (constant and harmonic coefficients) are tabulated by FFC as dofs of every cell, they are kept in the skeleton.
+The operator has zero diagonal blocks, hence the interior block of a cell is usually singular : only the largest subset of the interior dofs with an invertible
+block (found by a pivoted QR on one cell and checked on all of them) is eliminated, cells where this subset is ill conditioned keep all their dofs.
+This only work in serial.
+"""
+
+from dolfin import *
+import numpy as np
+import scipy.linalg
+from scipy.sparse import csr_matrix, coo_matrix
+from scipy.sparse.linalg import splu
+from BTordering import real_dofs
+
+def cell_dofs(W,mesh):
+    """
+    Dofs of W attached to the cells, one row per cell, without the Real dofs (shared by all the cells).
+    """
+    tdim = mesh.topology().dim()
+    mesh.init(tdim)
+    dofs = np.asarray(W.dofmap().entity_dofs(mesh,tdim),dtype=np.int64).reshape(mesh.num_cells(),-1)
+    real = np.isin(dofs,real_dofs(W))
+    if np.any(np.any(real,axis=0) != np.all(real,axis=0)):
+        raise RuntimeError("The Real dofs are not at the same local position in every cell")
+    return dofs[:,~np.any(real,axis=0)]
+
+def cell_blocks(A,dofs):
+    """
+    Dense diagonal blocks A[dofs[c]][:,dofs[c]] for each cell c, the interior dofs of different cells must not be coupled.
+    """
+    (nc,p) = dofs.shape
+    sub = A[dofs.ravel()][:,dofs.ravel()].tocoo()
+    if np.any(sub.row//p != sub.col//p):
+        raise RuntimeError("Interior dofs of different cells are coupled")
+    blocks = np.zeros((nc,p,p))
+    blocks[sub.row//p,sub.row % p,sub.col % p] = sub.data
+    return blocks
+
+def block_diagonal(blocks):
+    (nc,p,q) = blocks.shape
+    rows = np.repeat(np.arange(nc*p).reshape(nc,p,1),q,axis=2)
+    cols = np.repeat(np.arange(nc*q).reshape(nc,1,q),p,axis=1)
+    return coo_matrix((blocks.ravel(),(rows.ravel(),cols.ravel())),shape=(nc*p,nc*q)).tocsr()
+
+class Static_condensation:
+    """
+    Replacement of LUSolver(A) : solve(x,b) as for LUSolver, A is an assembled matrix on the mixed space W.
+    The skeleton system is factorized once by SuperLU. threshold bound the condition number of the eliminated blocks.
+    """
+    def __init__(self,A,W,mesh,threshold=1e10):
+        self.A = A
+        mat = as_backend_type(A).mat()
+        csr = csr_matrix(mat.getValuesCSR()[::-1], shape=mat.size)
+        n = csr.shape[0]
+        interior = cell_dofs(W,mesh)
+        self.inv = None
+        self.I = np.zeros(0,dtype=np.int64)
+        if (interior.shape[1] > 0):
+            blocks = cell_blocks(csr,interior)
+            # largest invertible principal block of one cell (the blocks are symmetric)
+            (Q,R,piv) = scipy.linalg.qr(blocks[0],pivoting=True)
+            d = np.abs(np.diag(R))
+            r = int(np.sum(d > 1e-10*max(d[0],1e-300)))
+            J = np.sort(piv[:r])
+            if (r > 0):
+                blocks = blocks[:,J][:,:,J]
+                ok = np.linalg.cond(blocks) < threshold
+                self.inv = np.linalg.inv(blocks[ok])
+                self.I = interior[ok][:,J].ravel()
+        print("Static condensation : {} of {} dofs eliminated".format(len(self.I),n))
+        skeleton = np.ones(n,dtype=bool)
+        skeleton[self.I] = False
+        self.S = np.flatnonzero(skeleton)
+        A_SS = csr[self.S][:,self.S]
+        if (len(self.I) > 0):
+            self.A_SI = csr[self.S][:,self.I]
+            self.A_IS = csr[self.I][:,self.S]
+            A_SS = A_SS - self.A_SI.dot(block_diagonal(self.inv).dot(self.A_IS))
+        self.lu = splu(A_SS.tocsc())
+
+    def apply_inverse(self,r):
+        (nc,p,q) = self.inv.shape
+        return np.einsum('cij,cj->ci',self.inv,r.reshape(nc,p)).ravel()
+
+    def solve(self,x,b):
+        bl = b.get_local()
+        y = np.zeros_like(bl)
+        if (len(self.I) > 0):
+            b_I = bl[self.I]
+            y[self.S] = self.lu.solve(bl[self.S] - self.A_SI.dot(self.apply_inverse(b_I)))
+            y[self.I] = self.apply_inverse(b_I - self.A_IS.dot(y[self.S]))
+        else:
+            y[self.S] = self.lu.solve(bl[self.S])
+        x.set_local(y)
+        x.apply("insert")
+
+def check_condensation(solver,tol=1e-8):
+    """
+    Compare the solve of Static_condensation with LUSolver on the operator of solver (an initialised BiotSavart_harmonic, serial) for a random right hand side.
+    Return the relative difference, a RuntimeError is raised when it is above tol.
+    """
+    A = solver.assemble_operator(force=True)
+    b = Function(solver.W).vector()
+    b.set_local(np.random.RandomState(0).rand(b.local_size()))
+    b.apply("insert")
+    x = Function(solver.W).vector()
+    y = Function(solver.W).vector()
+    LUSolver(A).solve(x,b)
+    Static_condensation(A,solver.W,solver.mesh).solve(y,b)
+    difference = np.linalg.norm(x.get_local() - y.get_local())/np.linalg.norm(x.get_local())
+    if (difference > tol):
+        raise RuntimeError("Static condensation differ from LUSolver : relative difference {}".format(difference))
+    return difference
@@ -0,0 +1,129 @@
+from dolfin import *
+import numpy as np
+from scipy.sparse import csr_matrix
+from BTdec import to_petsc
+from BTerror import invalidate_projectors
+
+class Mesh_context:
+    """
+    Share the function spaces and the assembled exterior derivative blocks between the harmonic search and the solvers of the different
+    boundary condition variants (DBC or not) on one mesh.
+    Pass it to init_mesh(...,context=context) of BiotSavart_harmonic (2D or 3D) : each space is built once per element (function_space(element)),
+    so the search (BiotSavart_base) and the solver use the same F0, F1, ..., and the same mixed space when no harmonics are found.
+    The blocks a(d u,v) + a(u,d v) are assembled once, the ones of the search are reused by the solver (renumbered when the solver has harmonic dofs)
+    and each variant only add its own coupling term (constant and harmonics) and apply its boundary conditions.
+    get_solver(solver_class,DBC,**kwargs) return a solver initialised for the variant, solvers are cached by variant so that their factorization is reused.
+    All solvers sharing a context must use the same Elemdict.
+    A private context (created by init_mesh when none is given, used by a single solver) drop its derivative blocks once the solver has assembled its operator
+    (see release()), so that only the operator of the solver is kept.
+    """
+    def __init__(self,mesh,private=False):
+        self.mesh = mesh
+        self.private = private
+        self.registry = {}
+        self.derivatives = {}
+        self.solvers = {}
+
+    def function_space(self,element):
+        if element not in self.registry:
+            self.registry[element] = FunctionSpace(self.mesh,element)
+        return self.registry[element]
+
+    def set_spaces(self,solver):
+        solver.set_spaces(self.function_space)
+
+    def derivative(self,solver,key):
+        """
+        Return the derivative blocks of solver, assembled on the first call for each key unless the blocks of another key can be used.
+        """
+        if key not in self.derivatives:
+            W = solver.W
+            D = None
+            for (V,M) in self.derivatives.values():
+                if V is W:
+                    D = M
+                elif (D is None) and embeddable(V,W,self.mesh):
+                    D = embed_derivative(M,V,W,self.mesh)
+            if D is None:
+                D = assemble(solver.set_derivative(W))
+            self.derivatives[key] = (W,D)
+        return self.derivatives[key][1]
+
+    def invalidate(self):
+        """
+        Drop the derivative blocks after a displacement of the vertices, the spaces stay valid.
+        """
+        self.derivatives = {}
+
+    def release(self):
+        """
+        Called by the solver once its operator is assembled : a private context drop its derivative blocks, they are assembled again when needed.
+        """
+        if (self.private):
+            self.invalidate()
+
+    def update_coordinates(self,coordinates=None,inverse_iterations=3):
+        """
+        Move the vertices of the mesh (see BiotSavart_harmonic.update_coordinates) and update the cached solvers.
+        """
+        if coordinates is not None:
+            self.mesh.coordinates()[:] = coordinates
+        invalidate_projectors(self.mesh)
+        self.invalidate()
+        for solver in self.solvers.values():
+            solver.update_coordinates(inverse_iterations=inverse_iterations,invalidate=False)
+
+    def assemble(self,solver,key,fh1=[]):
+        """
+        Return the operator of solver without boundary conditions.
+        """
+        A = self.derivative(solver,key).copy()
+        A.axpy(1.,assemble(solver.set_coupling(solver.W,fh1,solver.DBC)),False)
+        return A
+
+    def get_solver(self,solver_class,DBC=False,Elemdict=None,**kwargs):
+        """
+        kwargs are passed to init_mesh.
+        """
+        if DBC not in self.solvers:
+            if Elemdict is not None:
+                solver = solver_class(DBC=DBC,Elemdict=Elemdict)
+            else:
+                solver = solver_class(DBC=DBC)
+            solver.init_mesh(self.mesh,context=self,**kwargs)
+            self.solvers[DBC] = solver
+        return self.solvers[DBC]
+
+def form_dofs(W,k,mesh):
+    """
+    Dofs of the k-form block of W ordered by entity then by local index, this order does not depend on the other blocks of W.
+    """
+    dm = W.sub(k).dofmap()
+    dofs = []
+    for d in range(mesh.topology().dim() + 1):
+        mesh.init(d)
+        dofs.append(np.asarray(dm.entity_dofs(mesh,d),dtype=np.int64))
+    return np.concatenate(dofs)
+
+def embeddable(V,W,mesh):
+    tdim = mesh.topology().dim()
+    if (mesh.mpi_comm().size > 1) or (V.num_sub_spaces() < tdim + 1) or (W.num_sub_spaces() < tdim + 1):
+        return False
+    return all(V.sub(k).ufl_element() == W.sub(k).ufl_element() for k in range(tdim + 1))
+
+def embed_derivative(D,V,W,mesh):
+    """
+    Renumber the derivative blocks D assembled on V into the dofs of W, both having the same form blocks (W may have more Real dofs).
+    """
+    P = np.full(V.dim(),-1,dtype=np.int64)
+    for k in range(mesh.topology().dim() + 1):
+        P[form_dofs(V,k,mesh)] = form_dofs(W,k,mesh)
+    mat = as_backend_type(D).mat()
+    B = csr_matrix(mat.getValuesCSR()[::-1], shape=mat.size).tocoo()
+    keep = (P[B.row] >= 0) & (P[B.col] >= 0)
+    n = W.dim()
+    # explicit diagonal so that DirichletBC can be applied without new allocation
+    rows = np.concatenate([P[B.row[keep]],np.arange(n)])
+    cols = np.concatenate([P[B.col[keep]],np.arange(n)])
+    vals = np.concatenate([B.data[keep],np.zeros(n)])
+    return to_petsc(csr_matrix((vals,(rows,cols)),shape=(n,n)))
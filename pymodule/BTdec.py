@@ -0,0 +1,178 @@
+"""
+Assembly of the mixed operator at lowest order (trimmed P- of degree 1) from the incidence matrices of the mesh.
+With these elements the degrees of freedom are (up to a global sign or scaling fixed by the element conventions) the values of the
+cochains on the vertices, edges, faces and cells, hence the exterior derivative is the signed incidence matrix of the mesh and only
+the mass matrices of the intermediate forms need to be assembled.
+The conventions of the elements are checked once per dimension on a small mesh against the assembly by UFL.
+This only work in serial.
+"""
+
+from dolfin import *
+import numpy as np
+from math import factorial
+from scipy.sparse import csr_matrix, diags
+from petsc4py import PETSc
+
+def DEC_applicable(Elemdict):
+    for key in Elemdict:
+        if (Elemdict[key]['form'] != 'trimmed') or (Elemdict[key]['degree'] != 1):
+            return False
+    return True
+
+def entity_vertices(mesh,k):
+    if (k == 0):
+        return np.arange(mesh.num_vertices()).reshape(-1,1)
+    mesh.init(k,0)
+    return mesh.topology()(k,0)().reshape(-1,k+1)
+
+def coboundary(mesh,k):
+    """
+    Signed incidence matrix from k-simplices to (k+1)-simplices, each simplex being oriented by the increasing order of its vertices.
+    """
+    mesh.init(k+1,k)
+    parents = np.sort(entity_vertices(mesh,k+1),axis=1)
+    children = mesh.topology()(k+1,k)().reshape(len(parents),k+2)
+    childvert = entity_vertices(mesh,k)[children]
+    # position in the parent of the vertex missing from each child
+    present = (parents[:,None,:,None] == childvert[:,:,None,:]).any(axis=3)
+    missing = np.argmin(present,axis=2)
+    rows = np.repeat(np.arange(len(parents)),k+2)
+    data = np.where(missing.ravel() % 2 == 0,1.,-1.)
+    return csr_matrix((data,(rows,children.ravel())),shape=(len(parents),mesh.num_entities(k)))
+
+def cell_orientation(mesh):
+    """
+    Return the sign of the orientation of the cells (vertices taken in increasing order) and their volume.
+    """
+    tdim = mesh.topology().dim()
+    X = mesh.coordinates()
+    cells = np.sort(mesh.cells(),axis=1)
+    det = np.linalg.det(X[cells[:,1:]] - X[cells[:,:1]])
+    return (np.sign(det),np.abs(det)/factorial(tdim))
+
+def entity_order(F,mesh,k):
+    return np.asarray(F.dofmap().entity_dofs(mesh,k))
+
+def mass_matrix(F,mesh,k):
+    """
+    Mass matrix of F with rows and columns ordered as the k-simplices of the mesh.
+    """
+    M = as_backend_type(assemble(inner(TrialFunction(F),TestFunction(F))*dx)).mat()
+    csr = csr_matrix(M.getValuesCSR()[::-1], shape=M.size)
+    ed = entity_order(F,mesh,k)
+    return csr[ed][:,ed]
+
+def DEC_blocks(mesh,F,factors):
+    """
+    Return the blocks (d u_k, v_{k+1}) ordered by the simplices of the mesh, the mass matrices of the intermediate forms and the volume of the cells.
+    F hold the spaces of the k-forms (only those for 0 < k < dim are used).
+    """
+    tdim = mesh.topology().dim()
+    (sign,vol) = cell_orientation(mesh)
+    masses = [None]*(tdim+1)
+    for k in range(1,tdim):
+        masses[k] = mass_matrix(F[k],mesh,k)
+    blocks = []
+    for k in range(tdim):
+        D = coboundary(mesh,k)
+        if (k+1 == tdim):
+            # the dofs of the top forms are cell values, the mass matrix diag(vol) cancel the 1/vol of the derivative
+            B = diags(sign).dot(D)
+        else:
+            B = masses[k+1].dot(D)
+        blocks.append(factors[k]*B.tocsr())
+    return (blocks,masses,vol)
+
+DEC_factors = {}
+def DEC_conventions(tdim):
+    """
+    Compare the incidence blocks to the UFL assembly on a small mesh and return the global factor of each block.
+    """
+    if tdim in DEC_factors:
+        return DEC_factors[tdim]
+    if (tdim == 2):
+        mesh = UnitSquareMesh(3,3,"crossed")
+        cell = 'triangle'
+    else:
+        mesh = UnitCubeMesh(2,2,2)
+        cell = 'tetrahedron'
+    F = [FunctionSpace(mesh,FiniteElement('P-',cell=cell,degree=1,form_degree=k)) for k in range(tdim+1)]
+    (blocks,masses,vol) = DEC_blocks(mesh,F,[1.]*tdim)
+    factors = []
+    for k in range(tdim):
+        u = TrialFunction(F[k])
+        v = TestFunction(F[k+1])
+        if (k == 0):
+            du = grad(u)
+        elif (tdim == 2):
+            du = u[1].dx(0) - u[0].dx(1)
+        elif (k == 1):
+            du = curl(u)
+        else:
+            du = div(u)
+        M = as_backend_type(assemble(inner(du,v)*dx)).mat()
+        ref = csr_matrix(M.getValuesCSR()[::-1], shape=M.size)
+        ref = ref[entity_order(F[k+1],mesh,k+1)][:,entity_order(F[k],mesh,k)]
+        B = blocks[k]
+        s = ref.multiply(B).sum()/B.multiply(B).sum()
+        if (abs(ref - s*B).sum() > 1e-10*abs(ref).sum()):
+            raise RuntimeError("The incidence assembly does not match the conventions of the elements for the derivative of the {}-forms".format(k))
+        factors.append(s)
+    DEC_factors[tdim] = factors
+    return factors
+
+def assemble_DEC(W,mesh,fh1=[],DBC=False):
+    """
+    Assemble the mixed operator of BiotSavart_harmonic (2D or 3D) on W without boundary conditions.
+    fh1 is the list of harmonic forms (functions on F1 in 2D and F12 in 3D).
+    Return a PETScMatrix.
+    """
+    tdim = mesh.topology().dim()
+    factors = DEC_conventions(tdim)
+    F = [None]*(tdim+1)
+    for k in range(1,tdim):
+        F[k] = FunctionSpace(mesh,W.sub(k).ufl_element())
+    (blocks,masses,vol) = DEC_blocks(mesh,F,factors)
+    idx = [np.asarray(W.sub(k).dofmap().entity_dofs(mesh,k)) for k in range(tdim+1)]
+    n = W.dim()
+    # explicit diagonal so that DirichletBC can be applied without new allocation
+    rows = [np.arange(n)]
+    cols = [np.arange(n)]
+    vals = [np.zeros(n)]
+    for k in range(tdim):
+        B = blocks[k].tocoo()
+        rows += [idx[k+1][B.row],idx[k][B.col]]
+        cols += [idx[k][B.col],idx[k+1][B.row]]
+        vals += [B.data,B.data]
+    real = W.sub(tdim+1).dofmap().dofs()[0]
+    if (DBC):
+        (form,m) = (tdim,vol)
+    else:
+        cells = mesh.cells()
+        (form,m) = (0,np.bincount(cells.ravel(),weights=np.repeat(vol/(tdim+1),tdim+1),minlength=mesh.num_vertices()))
+    rows += [idx[form],np.full(len(m),real)]
+    cols += [np.full(len(m),real),idx[form]]
+    vals += [m,m]
+    for i in range(len(fh1)):
+        hdof = W.sub(tdim+2).sub(i).dofmap().dofs()[0]
+        h = fh1[i].vector().get_local()
+        V = fh1[i].function_space()
+        if (tdim == 2):
+            parts = [(1,masses[1].dot(h[entity_order(V,mesh,1)]))]
+        else:
+            parts = [(1,masses[1].dot(h[entity_order(V.sub(0),mesh,1)])),(2,masses[2].dot(h[entity_order(V.sub(1),mesh,2)]))]
+        for (k,mh) in parts:
+            rows += [idx[k],np.full(len(mh),hdof)]
+            cols += [np.full(len(mh),hdof),idx[k]]
+            vals += [mh,mh]
+    return to_petsc(csr_matrix((np.concatenate(vals),(np.concatenate(rows),np.concatenate(cols))),shape=(n,n)))
+
+def to_petsc(A):
+    """
+    Convert a scipy sparse matrix into a PETScMatrix (explicit zeros are kept in the pattern).
+    """
+    A = A.tocsr()
+    A.sort_indices()
+    mat = PETSc.Mat().createAIJ(size=A.shape,csr=(A.indptr.astype(PETSc.IntType),A.indices.astype(PETSc.IntType),A.data))
+    mat.assemble()
+    return PETScMatrix(mat)
@@ -0,0 +1,101 @@
+"""
+Fast evaluation of the errors of the convergence studies.
+Projections reuse the factorization of the mass matrix of each space (cached by mesh and element, so that equal spaces of different solvers share it,
+call invalidate_projectors when the vertices of a mesh are moved by other means than update_coordinates),
+the spaces of discontinuous elements (the top forms) are projected cell by cell with LocalSolver.
+errornorm interpolate the reference into a quadrature space (evaluated in C++ for all the quadrature points at once) instead of a space of higher degree,
+the quadrature degree must be large enough for the reference and the discrete function (default 6).
+form_errors and projection_errors replace the errornorm(ref,project(...)) sequences of the notebooks.
+"""
+
+from dolfin import *
+import numpy as np
+from collections import OrderedDict
+
+def is_discontinuous(V):
+    return V.ufl_element().family() in ('Discontinuous Lagrange','DG')
+
+class Projector:
+    """
+    L2 projection on V with a cached factorization of the mass matrix.
+    """
+    def __init__(self,V):
+        self.V = V
+        self.v = TestFunction(V)
+        a = inner(TrialFunction(V),self.v)*dx
+        self.local = is_discontinuous(V)
+        if (self.local):
+            self.solver = LocalSolver(a)
+            self.solver.factorize()
+        else:
+            self.solver = LUSolver(assemble(a))
+
+    def project(self,expr,out=None):
+        if out is None:
+            out = Function(self.V)
+        b = assemble(inner(expr,self.v)*dx)
+        if (self.local):
+            self.solver.solve_local(out.vector(),b,self.V.dofmap())
+        else:
+            self.solver.solve(out.vector(),b)
+        return out
+
+projectors = OrderedDict()
+max_projectors = 16
+def get_projector(V):
+    key = (V.mesh().id(),V.ufl_element())
+    if key in projectors:
+        projectors.move_to_end(key)
+    else:
+        projectors[key] = Projector(V)
+        if (len(projectors) > max_projectors):
+            projectors.popitem(last=False)
+    return projectors[key]
+
+def invalidate_projectors(mesh):
+    """
+    Drop the projectors of mesh, their mass matrices are wrong once the vertices moved (called by update_coordinates of the solvers).
+    """
+    for key in [k for k in projectors if k[0] == mesh.id()]:
+        del projectors[key]
+
+def fast_project(expr,V):
+    return get_projector(V).project(expr)
+
+quadrature_spaces = {}
+def quadrature_space(mesh,shape,degree):
+    key = (mesh.id(),shape,degree)
+    if key not in quadrature_spaces:
+        if (len(shape) == 0):
+            Q = FiniteElement("Quadrature",mesh.ufl_cell(),degree,quad_scheme="default")
+        else:
+            Q = VectorElement("Quadrature",mesh.ufl_cell(),degree,dim=shape[0],quad_scheme="default")
+        if any(k[0] != key[0] for k in quadrature_spaces):
+            quadrature_spaces.clear() # only the spaces of the current mesh are kept
+        quadrature_spaces[key] = FunctionSpace(mesh,Q)
+    return quadrature_spaces[key]
+
+def fast_errornorm(ref,u,degree=6):
+    """
+    L2 norm of ref - u, ref is an Expression (or any UFL expression) and u a Function.
+    """
+    mesh = u.function_space().mesh()
+    dxq = dx(domain=mesh,metadata={'quadrature_degree' : degree, 'quadrature_rule' : 'default'})
+    if isinstance(ref,Expression):
+        refq = Function(quadrature_space(mesh,ref.ufl_shape,degree))
+        refq.interpolate(ref)
+        ref = refq
+    e = ref - u
+    return np.sqrt(abs(assemble(inner(e,e)*dxq)))
+
+def form_errors(u,ref,du,refd,spaces,degree=6):
+    """
+    Return [|ref - u|] + [|refd - P_V du| for V in spaces], P_V being the L2 projection on V (in the notebook du = curl2d(B) and spaces = [F0,F2]).
+    """
+    return [fast_errornorm(ref,u,degree)] + [fast_errornorm(refd,fast_project(du,V),degree) for V in spaces]
+
+def projection_errors(ref,V,refd,spaces,degree=6):
+    """
+    Return [|ref - P_V ref|] + [|refd - P_W refd| for W in spaces], the best approximation errors of the spaces.
+    """
+    return [fast_errornorm(ref,fast_project(ref,V),degree)] + [fast_errornorm(refd,fast_project(refd,W),degree) for W in spaces]
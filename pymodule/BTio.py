@@ -0,0 +1,190 @@
+from dolfin import *
+import numpy as np
+import h5py
+from mpi4py import MPI as mpi4py_MPI
+
+class Solution_writer:
+    """
+    Write many solutions of a BiotSavart_harmonic (2D or 3D) on the same mesh into a single HDF5 file (filename.h5) with an XDMF description (filename.xdmf).
+    The mesh is written once in /mesh (by dolfin, so that it can be read back with HDF5File), then append(usol,time=None) store the dof vector of
+    each block of the mixed space (f0, f1, ... for the forms, ph for the constant and ph1 for the harmonics coefficients) as a new row of /solutions/<block>.
+    Rows are buffered and written chunk by chunk (chunk rows at a time), call close() (or flush()) to write the remaining ones.
+    compression is passed to h5py ('gzip', 'lzf' or None), it is not available for parallel writes.
+    When capacity (maximal number of solutions) is given and there is no compression the datasets are contiguous, Solution_reader.memmap() can then read them without copy.
+    In parallel (mesh on more than one process) the file is opened with the mpio driver, this require h5py built with MPI support.
+    The columns of /solutions/<block> are ordered as the global dofs of the mixed space listed in /dofs/<block>.
+    """
+    def __init__(self,solver,filename,chunk=64,compression=None,capacity=None):
+        self.filename = filename
+        self.chunk = chunk
+        self.mesh = solver.mesh
+        self.comm = solver.mesh.mpi_comm()
+        self.parallel = (self.comm.size > 1)
+        if (self.parallel) and (compression is not None):
+            print("Compression is not supported for parallel writes, ignoring it")
+            compression = None
+        # the mesh is written by dolfin to stay readable with HDF5File
+        meshfile = HDF5File(self.comm,filename + ".h5","w")
+        meshfile.write(self.mesh,"/mesh")
+        meshfile.close()
+        if (self.parallel):
+            self.file = h5py.File(filename + ".h5","a",driver='mpio',comm=self.comm)
+        else:
+            self.file = h5py.File(filename + ".h5","a")
+        W = solver.W
+        nsub = W.num_sub_spaces()
+        nforms = nsub - 1
+        if (solver.n1 > 0):
+            nforms -= 1
+        self.blocks = ['f{}'.format(i) for i in range(nforms)] + ['ph']
+        if (solver.n1 > 0):
+            self.blocks.append('ph1')
+        (r0,r1) = W.dofmap().ownership_range()
+        self.columns = [] # (first column, last column, local indices) of the dofs owned by this process
+        self.datasets = []
+        for i in range(len(self.blocks)):
+            dofs = np.sort(np.concatenate(self.comm.allgather(np.asarray(W.sub(i).dofmap().dofs(),dtype=np.int64))))
+            self.file.create_dataset("/dofs/" + self.blocks[i],data=dofs)
+            c0 = np.searchsorted(dofs,r0)
+            c1 = np.searchsorted(dofs,r1)
+            self.columns.append((c0,c1,dofs[c0:c1] - r0))
+            if (capacity is not None) and (compression is None):
+                dset = self.file.create_dataset("/solutions/" + self.blocks[i],shape=(capacity,len(dofs)),dtype='f8')
+            else:
+                dset = self.file.create_dataset("/solutions/" + self.blocks[i],shape=(0,len(dofs)),dtype='f8',
+                                                maxshape=(None,len(dofs)),chunks=(chunk,max(1,min(len(dofs),2**20//(8*chunk)))),
+                                                compression=compression)
+            self.datasets.append(dset)
+        self.times = self.file.create_dataset("/times",shape=(0,),dtype='f8',maxshape=(None,),chunks=(max(chunk,1),))
+        self.capacity = capacity
+        self.count = 0
+        self.buffer = [np.empty((chunk,c1 - c0)) for (c0,c1,loc) in self.columns]
+        self.buffer_times = np.empty(chunk)
+        self.nbuffered = 0
+
+    def append(self,usol,time=None):
+        local = usol.vector().get_local()
+        for i in range(len(self.blocks)):
+            self.buffer[i][self.nbuffered] = local[self.columns[i][2]]
+        if time is None:
+            time = float(self.count + self.nbuffered)
+        self.buffer_times[self.nbuffered] = time
+        self.nbuffered += 1
+        if (self.nbuffered == self.chunk):
+            self.flush()
+
+    def flush(self):
+        # every process must take part in the resize, even without anything to write
+        n = self.nbuffered
+        if (self.parallel):
+            n = self.comm.allreduce(n,op=mpi4py_MPI.MAX)
+        if (n == 0):
+            return
+        if (self.capacity is not None) and (self.count + n > self.capacity) and (self.datasets[0].maxshape[0] is not None):
+            raise RuntimeError("Capacity of {} solutions exceeded".format(self.capacity))
+        for i in range(len(self.blocks)):
+            dset = self.datasets[i]
+            if (dset.shape[0] < self.count + n):
+                dset.resize(self.count + n,axis=0)
+            (c0,c1,loc) = self.columns[i]
+            dset[self.count:self.count + n,c0:c1] = self.buffer[i][:n]
+        self.times.resize(self.count + n,axis=0)
+        self.times[self.count:self.count + n] = self.buffer_times[:n]
+        self.count += n
+        self.nbuffered = 0
+
+    def close(self):
+        self.flush()
+        self.file.attrs['count'] = self.count
+        self.file.close()
+        if (self.comm.rank == 0):
+            self.write_xdmf()
+
+    def write_xdmf(self):
+        tdim = self.mesh.topology().dim()
+        gdim = self.mesh.geometry().dim()
+        h5name = self.filename.split('/')[-1] + ".h5"
+        with h5py.File(self.filename + ".h5","r") as f:
+            (nvert,gd) = f["/mesh/coordinates"].shape
+            (ncell,nv) = f["/mesh/topology"].shape
+            times = f["/times"][:]
+            shapes = [f["/solutions/" + block].shape for block in self.blocks]
+        celltype = {2 : "Triangle", 3 : "Tetrahedron"}[tdim]
+        geotype = {2 : "XY", 3 : "XYZ"}[gdim]
+        lines = ['<?xml version="1.0"?>','<Xdmf Version="3.0" xmlns:xi="http://www.w3.org/2001/XInclude">','  <Domain>',
+                 '    <Grid Name="mesh" GridType="Uniform">',
+                 '      <Topology TopologyType="{}" NumberOfElements="{}">'.format(celltype,ncell),
+                 '        <DataItem Dimensions="{} {}" NumberType="Int" Format="HDF">{}:/mesh/topology</DataItem>'.format(ncell,nv,h5name),
+                 '      </Topology>',
+                 '      <Geometry GeometryType="{}">'.format(geotype),
+                 '        <DataItem Dimensions="{} {}" Format="HDF">{}:/mesh/coordinates</DataItem>'.format(nvert,gd,h5name),
+                 '      </Geometry>','    </Grid>',
+                 '    <Grid Name="solutions" GridType="Collection" CollectionType="Temporal">']
+        # dofs of the forms are not nodal values, they are exposed as raw arrays on the mesh
+        for k in range(self.count):
+            lines.append('      <Grid Name="solution_{}" GridType="Uniform">'.format(k))
+            lines.append('        <xi:include xpointer="xpointer(//Grid[@Name=\'mesh\']/*[self::Topology or self::Geometry])" />')
+            lines.append('        <Time Value="{}"/>'.format(times[k]))
+            for i in range(len(self.blocks)):
+                lines.append('        <Attribute Name="{}" AttributeType="Scalar" Center="Other">'.format(self.blocks[i]))
+                lines.append('          <DataItem ItemType="HyperSlab" Dimensions="1 {}" Format="XML">'.format(shapes[i][1]))
+                lines.append('            <DataItem Dimensions="3 2" Format="XML">{} 0 1 1 1 {}</DataItem>'.format(k,shapes[i][1]))
+                lines.append('            <DataItem Dimensions="{} {}" Format="HDF">{}:/solutions/{}</DataItem>'.format(shapes[i][0],shapes[i][1],h5name,self.blocks[i]))
+                lines.append('          </DataItem>')
+                lines.append('        </Attribute>')
+            lines.append('      </Grid>')
+        lines += ['    </Grid>','  </Domain>','</Xdmf>']
+        with open(self.filename + ".xdmf","w") as outfile:
+            outfile.write("\n".join(lines) + "\n")
+
+class Solution_reader:
+    """
+    Read back a file written by Solution_writer (filename without extension).
+    read(block,index=slice(None),out=None) read rows of a block into out (allocated if None) without intermediate copy.
+    memmap(block) return a read-only numpy.memmap over the block when the dataset is contiguous and uncompressed (written with a capacity).
+    to_function(i,u) set the i-th solution into u, a function on the mixed space of a solver initialised on the same mesh.
+    """
+    def __init__(self,filename):
+        self.filename = filename
+        self.file = h5py.File(filename + ".h5","r")
+        self.count = int(self.file.attrs['count']) if 'count' in self.file.attrs else self.file["/times"].shape[0]
+        self.blocks = list(self.file["/solutions"].keys())
+        self.times = self.file["/times"][:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def dofs(self,block):
+        return self.file["/dofs/" + block][:]
+
+    def read(self,block,index=slice(None),out=None):
+        dset = self.file["/solutions/" + block]
+        rows = np.atleast_1d(np.arange(self.count)[index])
+        if out is None:
+            out = np.empty((len(rows),dset.shape[1]))
+        if (len(rows) == 0):
+            return out
+        if np.all(np.diff(rows) == 1):
+            dset.read_direct(out,np.s_[rows[0]:rows[-1] + 1])
+        else:
+            out[...] = dset[list(rows),:] # h5py require increasing indices
+        return out
+
+    def memmap(self,block):
+        dset = self.file["/solutions/" + block]
+        offset = dset.id.get_offset()
+        if (dset.chunks is not None) or (offset is None):
+            raise RuntimeError("Dataset {} is chunked or compressed, use read() instead".format(block))
+        return np.memmap(self.filename + ".h5",dtype=dset.dtype,mode='r',offset=offset,shape=dset.shape)[:self.count]
+
+    def to_function(self,i,u):
+        x = np.zeros(u.function_space().dim())
+        for block in self.blocks:
+            x[self.dofs(block)] = self.file["/solutions/" + block][i]
+        (r0,r1) = u.vector().local_range()
+        u.vector().set_local(x[r0:r1])
+        u.vector().apply("insert")
+        return u
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,409 @@
+"""
+Null space solvers of the harmonic search, shared by BTsolver_2D and BTsolver_3D.
+They only see the assembled operator (a PETSc matrix or a Sparse_operator, see BTbridge) and the vectors of the mixed space as arrays,
+this module does not import dolfin so that null_space_job can run in a worker process of BTasync without initialising it.
+Each solver expose Get_Dim, Get_Confidence and Get_Vector(i,out=None) (out is a dolfin vector, written with write_vector).
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix, identity
+from scipy.sparse.linalg import eigsh, splu, lobpcg, LinearOperator
+from petsc4py import PETSc
+from slepc4py import SLEPc
+from sparseqr import qr
+from BTbridge import Sparse_operator, as_operator, write_vector, amg_preconditioner
+from BTasync import Search_result
+
+def detect_gap(values,zero,gap=1e4):
+    """
+    values are the smallest singular values found so far and zero the value under which a computed value may belong to the null space (see zero_threshold).
+    Return (dimension,confidence) where dimension is the number of values before the first relative jump larger than gap between two consecutive values,
+    the value before the jump being under zero, and confidence the size of this jump in decades, or (None,0.) when no such jump is found yet.
+    The null space is trivial when the first value is above zero, confidence is then the distance to zero in decades.
+    """
+    values = np.sort(np.abs(values))
+    if (len(values) == 0):
+        return (None,0.)
+    if (values[0] > zero):
+        return (0,np.log10(values[0]/zero))
+    ratios = values[1:]/np.maximum(values[:-1],np.finfo(float).tiny)
+    jumps = np.nonzero((ratios > gap) & (values[:-1] <= zero))[0]
+    if (len(jumps) == 0):
+        return (None,0.)
+    return (jumps[0] + 1,np.log10(ratios[jumps[0]]))
+
+def zero_threshold(Tunning,scale,tol):
+    """
+    Absolute cutoff of detect_gap : Tunning["zero_threshold"] when set, else 100*tol*scale where tol is the accuracy of the computed values relative to the norm scale of the operator.
+    """
+    if ("zero_threshold" in Tunning):
+        return Tunning["zero_threshold"]
+    return 1e2*tol*scale
+
+def adaptive_parameters(Tunning,expected_harmonics):
+    block = Tunning["block"] if "block" in Tunning else 2
+    gap = Tunning["gap"] if "gap" in Tunning else 1e4
+    max_harmonics = Tunning["max_harmonics"] if "max_harmonics" in Tunning else 2*max(expected_harmonics,1) + block
+    return (block,gap,max_harmonics)
+
+# Warning : the solver is not stateless, not only in its options but for solving with different ncv&mpd after a failure may work while solving with the exact same ncv&mpd without previous failure won't.
+class SVD_null_space_solver:
+    def __init__(self,mat,Tunning={},expected_harmonics=2,printvp=False,customthreshold=1e-15):
+        mat = as_operator(mat).petsc()
+        self.vr = PETSc.Vec().create()
+        self.vr.setSizes(mat.size[0])
+        self.vr.setFromOptions()
+        self.vl = PETSc.Vec().create()
+        self.vl.setSizes(mat.size[0])
+        self.vl.setFromOptions()
+        
+        self.S = SLEPc.SVD(); self.S.create()
+        self.S.setOperator(mat)
+        self.S.setWhichSingularTriplets(SLEPc.SVD.Which.SMALLEST)
+        if ("max_auto_ncv" in Tunning):
+            max_auto_ncv = Tunning["max_auto_ncv"]
+        else:
+            max_auto_ncv = 200
+        self.confidence = None
+        
+        if ("adaptive" in Tunning) and (Tunning["adaptive"]):
+            self.adaptive_solve(mat,Tunning,expected_harmonics,printvp,customthreshold,max_auto_ncv)
+            return
+        if ("ncv" in Tunning) and (Tunning["ncv"] > 0) and ("mpd" in Tunning) and (Tunning["mpd"] > 0):
+            print("Using custom value : {} {}".format(Tunning["ncv"],Tunning["mpd"]))
+            self.S.setDimensions(expected_harmonics,Tunning["ncv"],Tunning["mpd"])
+            try:
+                self.S.solve()
+            except Exception as e:
+                print("Exeption encountered while solving :" + str(e) + " \n Giving up (auto increase does not apply with user supplied parameter ncv and mpd")
+                raise
+            self.numberconverged = self.S.getConverged()
+        else:
+            nsv = expected_harmonics
+            ncv = max(16,nsv*2)
+            #mpd =
+            self.S.setDimensions(nsv,ncv,ncv)
+            try:
+                self.S.solve()
+            except Exception as e:
+                self.numberconverged = 0
+                print("Exeption encountered while solving :" + str(e) + " \n Trying with higher ncv and mpd")
+            else:
+                self.numberconverged = self.S.getConverged()
+            # will raise an error when ncv get too big
+            while((self.numberconverged < expected_harmonics) and (ncv < max_auto_ncv)):
+                ncv += 10
+                if (printvp): # assume the user want more information
+                    print("Retrying with ncv = mpd = {}\n".format(ncv))
+                self.S.setDimensions(nsv,ncv,ncv)
+                try:
+                    self.S.solve()
+                except Exception as e:
+                    self.numberconverged = 0
+                    print("Exeption encountered while solving :" + str(e) + " \n Trying with higher ncv and mpd")
+                    if (ncv >= max_auto_ncv):
+                        raise RuntimeError('ncv reached max_auto_ncv without finding enough harmonics and the last try raised an error in the solver. Giving up as it would be left in an unstable state')
+                else:
+                    self.numberconverged = self.S.getConverged()
+        self.n = 0
+        for i in range(self.numberconverged):
+            if (printvp):
+                print(self.S.getSingularTriplet(i))
+            if (self.S.getSingularTriplet(i) < customthreshold):
+                self.n += 1
+    def adaptive_solve(self,mat,Tunning,expected_harmonics,printvp,customthreshold,max_auto_ncv):
+        # ask for a few more values at a time and stop as soon as a gap separate the null space,
+        # each solve start from the right singular vectors of the previous one
+        (block,gap,max_harmonics) = adaptive_parameters(Tunning,expected_harmonics)
+        scale = mat.norm(PETSc.NormType.NORM_INFINITY)
+        nsv = block
+        self.n = None
+        values = []
+        space = []
+        while (self.n is None) and (nsv <= max_harmonics + 1):
+            if (len(space) > 0):
+                if hasattr(self.S,"setInitialSpaces"):
+                    self.S.setInitialSpaces(space)
+                else:
+                    self.S.setInitialSpace(space)
+            ncv = max(16,2*nsv)
+            converged = self.solve_dimensions(nsv,ncv)
+            while ((converged is None) or (converged < nsv)) and (ncv < max_auto_ncv):
+                ncv += 10
+                converged = self.solve_dimensions(nsv,ncv)
+            if converged is None:
+                raise RuntimeError('ncv reached max_auto_ncv without finding enough harmonics and the last try raised an error in the solver. Giving up as it would be left in an unstable state')
+            self.numberconverged = converged
+            values = []
+            space = []
+            for i in range(self.numberconverged):
+                v = mat.createVecRight()
+                values.append(self.S.getSingularTriplet(i,None,v))
+                space.append(v)
+            if (printvp):
+                print("Requested {} values, converged : {}".format(nsv,values))
+            (self.n,self.confidence) = detect_gap(values,zero_threshold(Tunning,scale,self.S.getTolerances()[0]),gap)
+            nsv += block
+        if self.n is None:
+            print("No spectral gap found within {} values, using the threshold".format(len(values)))
+            self.n = int(np.sum(np.array(values) < customthreshold))
+            self.confidence = 0.
+    def solve_dimensions(self,nsv,ncv):
+        # return the number of converged values, None when the solver raised an error
+        self.S.setDimensions(nsv,ncv,ncv)
+        try:
+            self.S.solve()
+        except Exception as e:
+            print("Exeption encountered while solving :" + str(e) + " \n Trying with higher ncv and mpd")
+            return None
+        return self.S.getConverged()
+    def Get_Dim(self):
+        return self.n
+    def Get_Confidence(self):
+        return self.confidence
+    def Get_Vector(self,i,out=None):
+        self.S.getSingularTriplet(i,self.vl,self.vr)
+        if out is not None:
+            return write_vector(self.vr.getArray(),out)
+        return self.vr.getArray()
+
+class SuiteSparseQR_solver:
+    def __init__(self,mat,Tunning={},expected_harmonics=2,printvp=False,customthreshold=1e-15):
+        csr = as_operator(mat).csr()
+        # mat = csr.transpose().tocoo() # optionnal, doc of sparseqr specify that coo is the optimal input format
+        Q, R, E, rank = qr( csr.transpose())
+        self.confidence = None
+        if ("adaptive" in Tunning) and (Tunning["adaptive"]):
+            # the factorization is complete, only the detection of the dimension change
+            (block,gap,max_harmonics) = adaptive_parameters(Tunning,expected_harmonics)
+            values = np.abs(R.diagonal())[::-1][:max_harmonics + 1]
+            if (printvp):
+                print(values)
+            # the diagonal of R reveal the rank up to a few orders of magnitude above the round-off
+            (self.n,self.confidence) = detect_gap(values,zero_threshold(Tunning,abs(csr).sum(axis=1).max(),np.sqrt(np.finfo(float).eps)),gap)
+            if self.n is None:
+                print("No spectral gap found within {} values, using the threshold".format(len(values)))
+                self.n = int(np.sum(values < customthreshold))
+                self.confidence = 0.
+            self.N = Q.tocsc()[:,Q.shape[1] - self.n:]
+            return
+        max_rank = max(expected_harmonics,rank) + 1
+        self.n = 0
+        for i in range(1,max_rank):
+            if(printvp):
+                print(R[-i])
+            if(R[-i] < customthreshold):
+                self.n += 1
+        if(printvp):
+            print("Next value would be : {}\n".format(R[-max_rank]))
+        self.N = Q.tocsc()[:,rank:]
+    def Get_Dim(self):
+        return self.n
+    def Get_Confidence(self):
+        return self.confidence
+    def Get_Vector(self,i,out=None):
+        if out is not None:
+            return write_vector(self.N[:,i].toarray().ravel(),out)
+        return self.N[:,i].toarray().ravel()
+
+class Scipy_eigs_solver:
+    """
+    The operator is symmetric : its null space is found with eigsh in shift-invert mode on A itself, the singular values are the absolute values of the eigenvalues.
+    A^T A is never formed (it would hold several times the nonzeros of A, and its factorization more fill).
+    The reported eigenvalues (printvp, customthreshold) are still those of A^T A, the squares.
+    """
+    def __init__(self,mat,Tunning={},expected_harmonics=2,printvp=False,customthreshold=1e-15):
+        csr = as_operator(mat).csr()
+        scale = abs(csr).sum(axis=1).max()
+        # the shift only need to be closer to 0 than the smallest nonzero value of A
+        sigma = -1e-8*scale
+        if ("eigs_tol" in Tunning):
+            tol = Tunning["eigs_tol"]
+        else:
+            tol = 1e-6
+        self.confidence = None
+        if ("adaptive" in Tunning) and (Tunning["adaptive"]):
+            self.adaptive_solve(csr,Tunning,expected_harmonics,printvp,customthreshold,sigma,tol,scale)
+            return
+        self.shifted_solve(csr,expected_harmonics,sigma,tol)
+        
+        max_rank = max(expected_harmonics,len(self.eigenvalues))
+        self.n = 0
+        for i in range(max_rank):
+            if(printvp):
+                print(self.eigenvalues[i])
+            if(self.eigenvalues[i] < customthreshold):
+                self.n += 1
+    def shifted_solve(self,csr,k,sigma,tol,v0=None):
+        eigenvalues,eigenvectors = eigsh(csr,k=k,sigma=sigma,which='LM',tol=tol,v0=v0,return_eigenvectors=True)
+        order = np.argsort(np.abs(eigenvalues))
+        self.eigenvalues = eigenvalues[order]**2
+        self.eigenvectors = eigenvectors[:,order]
+    def adaptive_solve(self,csr,Tunning,expected_harmonics,printvp,customthreshold,sigma,tol,scale):
+        # ask for a few more values at a time and stop as soon as a gap separate the null space
+        (block,gap,max_harmonics) = adaptive_parameters(Tunning,expected_harmonics)
+        k = block
+        v0 = None
+        self.n = None
+        values = []
+        while (self.n is None) and (k <= max_harmonics + 1):
+            self.shifted_solve(csr,k,sigma,tol,v0)
+            values = np.sqrt(self.eigenvalues)
+            if (printvp):
+                print("Requested {} values : {}".format(k,values))
+            # the values are found up to tol*|sigma|, the round-off of the factorization dominate
+            (self.n,self.confidence) = detect_gap(values,zero_threshold(Tunning,scale,max(tol*abs(sigma)/scale,np.sqrt(np.finfo(float).eps))),gap)
+            v0 = self.eigenvectors[:,0]
+            k += block
+        if self.n is None:
+            print("No spectral gap found within {} values, using the threshold".format(len(values)))
+            self.n = int(np.sum(self.eigenvalues < customthreshold))
+            self.confidence = 0.
+    def Get_Dim(self):
+        return self.n
+    def Get_Confidence(self):
+        return self.confidence
+    def Get_Vector(self,i,out=None):
+        if out is not None:
+            return write_vector(self.eigenvectors[:,i],out)
+        return self.eigenvectors[:,i]
+
+# No factorization, only the preconditioner is assembled : memory is O(nnz(A^2) + N*block) with the AMG preconditioners (A^2 is assembled for the hierarchy)
+# and O(nnz(A) + N*block) with "jacobi" or "none"
+def lobpcg_preconditioner(csr,Tunning={}):
+    """
+    Preconditioner of A^2 selected by Tunning["lobpcg_preconditioner"] (see BiotSavart_harmonic), None for "none".
+    """
+    n = csr.shape[0]
+    scale = abs(csr).sum(axis=1).max()
+    kind = Tunning["lobpcg_preconditioner"] if ("lobpcg_preconditioner" in Tunning) else None
+    if (kind == "none"):
+        print("LOBPCG without preconditioner")
+        return None
+    if (kind == "jacobi"):
+        # the diagonal of A^2 is given by the norms of the columns of A, A^2 is not formed
+        d = np.asarray(abs(csr).power(2).sum(axis=0)).ravel() + 1e-10*scale**2
+        return LinearOperator((n,n),matvec=lambda x : x.ravel()/d,matmat=lambda X : X/d[:,None],dtype=np.float64)
+    return amg_preconditioner(csr.dot(csr) + 1e-10*scale**2*identity(n),kind)
+
+class LOBPCG_solver:
+    """
+    X (one vector per column) seed the iteration, the dimension is then the one of X (polishing of a known basis, see polish_harmonic_basis).
+    M is a preconditioner built by lobpcg_preconditioner for an operator with the same pattern, it is kept in self.M to be reused.
+    """
+    def __init__(self,mat,Tunning={},expected_harmonics=2,printvp=False,customthreshold=1e-15,X=None,M=None):
+        csr = as_operator(mat).csr()
+        n = csr.shape[0]
+        if ("lobpcg_tol" in Tunning):
+            tol = Tunning["lobpcg_tol"]
+        else:
+            tol = 1e-8
+        if ("lobpcg_block" in Tunning):
+            block = Tunning["lobpcg_block"]
+        else:
+            block = expected_harmonics + 2
+        if ("lobpcg_maxiter" in Tunning):
+            maxiter = Tunning["lobpcg_maxiter"]
+        else:
+            maxiter = 500
+        scale = abs(csr).sum(axis=1).max()
+        # the operator is symmetric : its null space is the one of A^2, whose lowest eigenvalues are the squared singular values of A
+        AtA = LinearOperator((n,n),matvec=lambda x : csr.dot(csr.dot(x)),matmat=lambda X : csr.dot(csr.dot(X)),dtype=np.float64)
+        if M is None:
+            M = lobpcg_preconditioner(csr,Tunning)
+        self.M = M
+        seeded = X is not None
+        if not (seeded):
+            X = np.random.RandomState(0).rand(n,block)
+        eigenvalues,eigenvectors = lobpcg(AtA,X,M=M,tol=tol,maxiter=maxiter,largest=False)
+        order = np.argsort(eigenvalues)
+        self.eigenvalues = eigenvalues[order]
+        self.eigenvectors = eigenvectors[:,order]
+        values = np.sqrt(np.maximum(self.eigenvalues,0.))
+        if (printvp):
+            print(values)
+        if (seeded):
+            self.n = X.shape[1]
+            self.confidence = None
+            print("LOBPCG : relative residual {}".format(np.max(np.linalg.norm(csr.dot(self.eigenvectors),axis=0))/scale))
+            return
+        # the values of the null space are only resolved up to tol, the dimension is given by the gap
+        (block,gap,max_harmonics) = adaptive_parameters(Tunning,expected_harmonics)
+        # the residual of the eigenpairs of A^2 is below tol, the singular values of the null space are then of the order of sqrt(tol)
+        (self.n,self.confidence) = detect_gap(values,zero_threshold(Tunning,scale,np.sqrt(tol)/scale),gap)
+        if self.n is None:
+            print("No spectral gap found within {} values, using the threshold".format(len(values)))
+            self.n = int(np.sum(self.eigenvalues < customthreshold))
+            self.confidence = 0.
+    def Get_Dim(self):
+        return self.n
+    def Get_Confidence(self):
+        return self.confidence
+    def Get_Vector(self,i,out=None):
+        if out is not None:
+            return write_vector(self.eigenvectors[:,i],out)
+        return self.eigenvectors[:,i]
+
+class Inverse_iteration_solver:
+    """
+    Refine an approximation X (one vector per column) of the null space of mat by block inverse iteration with a small shift sigma (relative to the norm of mat).
+    Used by polish_harmonic_basis with Tunning["polish"] == "lu", the dimension is the one of X.
+    """
+    def __init__(self,mat,X,steps=3,sigma=1e-8):
+        csr = as_operator(mat).csr()
+        scale = abs(csr).sum(axis=1).max()
+        lu = splu((csr - sigma*scale*identity(csr.shape[0])).tocsc())
+        for step in range(steps):
+            X = np.linalg.qr(lu.solve(X))[0]
+        self.X = X
+        self.n = X.shape[1]
+        self.confidence = None
+        self.M = None
+        print("Inverse iteration : relative residual {}".format(np.max(np.linalg.norm(csr.dot(X),axis=0))/scale))
+    def Get_Dim(self):
+        return self.n
+    def Get_Confidence(self):
+        return self.confidence
+    def Get_Vector(self,i,out=None):
+        if out is not None:
+            return write_vector(self.X[:,i],out)
+        return self.X[:,i]
+
+def polish_harmonic_basis(mat,X,Tunning={},steps=3,preconditioner=None):
+    """
+    Refine the approximation X (one vector per column) of the null space of mat, the dimension is the one of X.
+    By default LOBPCG seeded with X (no factorization), preconditioned by preconditioner when given (built for an operator with the same pattern) else by lobpcg_preconditioner.
+    With Tunning["polish"] == "lu" steps steps of inverse iteration with a factorization of mat are used instead.
+    """
+    if ("polish" in Tunning) and (Tunning["polish"] == "lu"):
+        return Inverse_iteration_solver(mat,X,steps=steps)
+    return LOBPCG_solver(mat,Tunning=Tunning,expected_harmonics=X.shape[1],X=X,M=preconditioner)
+
+def null_space_solver(mat,Tunning={},expected_harmonics=2,printvp=False,customthreshold=1e-15):
+    """
+    Run the search selected by Tunning["solver"] on mat (a PETSc matrix or a Sparse_operator), this only use PETSc/scipy (see null_space_job for a worker process).
+    """
+    if ("solver" in Tunning) and (Tunning["solver"] == "SLEPc_SVD"):
+        Solver = SVD_null_space_solver(mat,Tunning=Tunning,expected_harmonics=expected_harmonics,
+                                       printvp=printvp,customthreshold=customthreshold)
+    elif ("solver" in Tunning) and (Tunning["solver"] == "SuiteSparse_QR"):
+        Solver = SuiteSparseQR_solver(mat,Tunning=Tunning,expected_harmonics=expected_harmonics,
+                                       printvp=printvp,customthreshold=customthreshold)
+    elif ("solver" in Tunning) and (Tunning["solver"] == "LOBPCG"):
+        Solver = LOBPCG_solver(mat,Tunning=Tunning,expected_harmonics=expected_harmonics,
+                                       printvp=printvp,customthreshold=customthreshold)
+    elif ("solver" in Tunning) and (Tunning["solver"] == "Scipy_eigs"):
+        Solver = Scipy_eigs_solver(mat,Tunning=Tunning,expected_harmonics=expected_harmonics,
+                                       printvp=printvp,customthreshold=customthreshold)
+    else:
+        Solver = Scipy_eigs_solver(mat,Tunning=Tunning,expected_harmonics=expected_harmonics,
+                                       printvp=printvp,customthreshold=customthreshold)
+    return Solver
+
+def null_space_job(arrays,shape,Tunning={},expected_harmonics=2,printvp=False,customthreshold=1e-15):
+    """
+    Run null_space_solver in a worker process of BTasync : the operator is given by its CSR arrays (data,indices,indptr), the result is a picklable Search_result.
+    """
+    operator = Sparse_operator(None,csr_matrix(arrays,shape=shape))
+    return Search_result(null_space_solver(operator,Tunning=Tunning,expected_harmonics=expected_harmonics,
+                                           printvp=printvp,customthreshold=customthreshold))
@@ -0,0 +1,130 @@
+"""
+Fill reducing ordering of the mixed operator.
+The Real dofs (constant and harmonic coefficients) couple with a whole form block and act as dense rows, they are ordered last and the rest of the graph
+is ordered by nested dissection (METIS through pymetis when installed, else reverse Cuthill-McKee from scipy).
+The permutation perm follow the METIS convention : the permuted matrix is A[perm][:,perm].
+Reordered_LU factorize the permuted operator with SuperLU for BiotSavart_harmonic.solve().
+compare_orderings report the fill and the time of the factorization with the permutation against the default path of the solver (PETSc LU as LUSolver,
+MUMPS when available, with its own ordering) and against SuperLU with its default COLAMD ordering.
+"""
+
+from dolfin import *
+import numpy as np
+import time
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+from scipy.sparse.linalg import splu
+from petsc4py import PETSc
+from BTbridge import as_operator, write_vector
+try:
+    import pymetis
+except ImportError:
+    pymetis = None
+
+def real_dofs(W):
+    """
+    Dofs of the Real sub spaces of W (searched recursively in the mixed sub elements).
+    """
+    dofs = []
+    for i in range(W.num_sub_spaces()):
+        V = W.sub(i)
+        if (V.ufl_element().family() == 'Real'):
+            dofs += list(V.dofmap().dofs())
+        elif (V.num_sub_spaces() > 0):
+            dofs += list(real_dofs(V))
+    return np.array(dofs,dtype=np.int64)
+
+def dense_rows(A,factor=10.):
+    """
+    Rows with more than factor times the median number of entries, used when the space is not known.
+    """
+    nnz = np.diff(A.indptr)
+    return np.flatnonzero(nnz > factor*max(np.median(nnz),1.))
+
+def fill_reducing_ordering(A,last=None,method="nested_dissection"):
+    """
+    A is a scipy sparse matrix, last the rows ordered at the end (default : dense_rows(A)).
+    """
+    A = A.tocsr()
+    n = A.shape[0]
+    if last is None:
+        last = dense_rows(A)
+    keep = np.ones(n,dtype=bool)
+    keep[last] = False
+    kept = np.flatnonzero(keep)
+    G = abs(A[kept][:,kept])
+    G = (G + G.transpose()).tocsr()
+    G.setdiag(0)
+    G.eliminate_zeros()
+    if (method == "nested_dissection") and (pymetis is not None):
+        (perm,iperm) = pymetis.nested_dissection(xadj=G.indptr,adjncy=G.indices)
+        perm = np.asarray(perm)
+    else:
+        if (method == "nested_dissection"):
+            print("pymetis is not available, using reverse Cuthill-McKee")
+        perm = reverse_cuthill_mckee(G,symmetric_mode=True)
+    return np.concatenate([kept[perm],np.asarray(last,dtype=np.int64)])
+
+def lu_fill(B,permc_spec='NATURAL'):
+    lu = splu(B.tocsc(),permc_spec=permc_spec)
+    return lu.L.nnz + lu.U.nnz
+
+def petsc_lu_fill(mat):
+    """
+    Factorize the PETSc matrix mat as LUSolver does by default (MUMPS when available, else PETSc LU, each with its own ordering).
+    Return the number of nonzeros of the factors reported by PETSc, None when the package does not report it.
+    """
+    for package in ('mumps','petsc'):
+        ksp = PETSc.KSP().create()
+        ksp.setOperators(mat)
+        ksp.setType('preonly')
+        pc = ksp.getPC()
+        pc.setType('lu')
+        pc.setFactorSolverType(package)
+        try:
+            ksp.setUp()
+        except PETSc.Error:
+            continue
+        fill = int(pc.getFactorMatrix().getInfo()['nz_used'])
+        return fill if (fill > 0) else None
+    return None
+
+def compare_orderings(A,perm,mat=None):
+    """
+    Print the fill and the time of the LU factorization of A (scipy) permuted by perm against the default LUSolver on mat (the PETSc matrix of A,
+    skipped when not given) and against SuperLU with its default ordering.
+    """
+    cases = [("SuperLU with the given ordering",lambda : lu_fill(A[perm][:,perm])),
+             ("SuperLU with COLAMD (its default)",lambda : lu_fill(A,'COLAMD'))]
+    if mat is not None:
+        cases.append(("LUSolver default (PETSc)",lambda : petsc_lu_fill(mat)))
+    for (name,factorize) in cases:
+        t = time.time()
+        fill = factorize()
+        elapsed = time.time() - t
+        if fill is None:
+            print("{} : fill not reported, {:.3f} s".format(name,elapsed))
+        else:
+            print("{} : {} nonzeros in the factors ({:.1f} x A), {:.3f} s".format(name,fill,fill/max(A.nnz,1),elapsed))
+
+class Reordered_LU:
+    """
+    Replacement of LUSolver(A) : solve(x,b) as for LUSolver, A (assembled on W) is permuted by fill_reducing_ordering with the Real dofs of W last
+    and factorized without further column ordering. Set report to print the comparison with the default LUSolver and SuperLU orderings (see compare_orderings).
+    perm reuse the permutation of a previous factorization with the same pattern.
+    """
+    def __init__(self,A,W,method="nested_dissection",report=False,perm=None):
+        mat = as_backend_type(A).mat()
+        csr = as_operator(mat).csr(release=False)
+        self.perm = perm
+        if self.perm is None:
+            self.perm = fill_reducing_ordering(csr,last=real_dofs(W),method=method)
+        if (report):
+            compare_orderings(csr,self.perm,mat)
+        self.lu = splu(csr[self.perm][:,self.perm].tocsc(),permc_spec='NATURAL')
+
+    def solve(self,x,b):
+        bl = b.get_local()
+        y = np.empty_like(bl)
+        y[self.perm] = self.lu.solve(bl[self.perm])
+        write_vector(y,x)
@@ -0,0 +1,68 @@
+"""
+Direct solve with a factorization in single precision corrected by iterative refinement in double precision.
+The factor of the mixed operator is the limiting memory of the direct solves, storing it in float32 roughly halve it while a few refinement
+steps against the operator in double precision recover the accuracy of the double factorization on reasonably conditioned systems.
+This rely on SuperLU (scipy) and only work in serial.
+"""
+
+from dolfin import *
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import splu
+
+class Mixed_precision_LU:
+    """
+    Replacement of LUSolver(A) for an assembled matrix A : solve(x,b) as for LUSolver.
+    The refinement stop when the relative residual is below tol. It is considered stalled when one step does not divide the residual by at least 2
+    or after max_steps steps, the factorization in double precision LUSolver(A,method) is then built and used for this and all the next solves.
+    iterations hold the number of refinement steps of the last solve (None once the fallback is used).
+    """
+    def __init__(self,A,tol=1e-12,max_steps=10,method='default'):
+        self.A = A
+        self.tol = tol
+        self.max_steps = max_steps
+        self.method = method
+        self.fallback = None
+        self.iterations = None
+        mat = as_backend_type(A).mat()
+        csr = csr_matrix(mat.getValuesCSR()[::-1], shape=mat.size)
+        try:
+            self.lu = splu(csr.astype(np.float32).tocsc())
+        except RuntimeError as e:
+            print("Single precision factorization failed ({}), falling back to double precision".format(e))
+            self.use_fallback()
+        del csr
+
+    def use_fallback(self):
+        self.lu = None
+        self.iterations = None
+        self.fallback = LUSolver(self.A,self.method)
+
+    def solve(self,x,b):
+        if self.fallback is not None:
+            self.fallback.solve(x,b)
+            return
+        bl = b.get_local()
+        nb = np.linalg.norm(bl)
+        y = np.zeros_like(bl)
+        r = bl.copy()
+        res = nb
+        previous = np.inf
+        self.iterations = 0
+        while (res > self.tol*nb):
+            if (self.iterations == self.max_steps) or not (res < previous/2):
+                print("Refinement stalled at relative residual {} after {} steps, falling back to double precision".format(res/nb,self.iterations))
+                self.use_fallback()
+                self.fallback.solve(x,b)
+                return
+            # the residual is normalised to stay in the range of float32
+            y += res*self.lu.solve((r/res).astype(np.float32)).astype(np.float64)
+            x.set_local(y)
+            x.apply("insert")
+            r = bl - (self.A*x).get_local()
+            previous = res
+            res = np.linalg.norm(r)
+            self.iterations += 1
+        x.set_local(y)
+        x.apply("insert")
+        print("Mixed precision solve : {} refinement steps, relative residual {}".format(self.iterations,res/max(nb,1e-300)))
@@ -0,0 +1,192 @@
+"""
+Long running solver service : the meshes, their harmonics and the factorizations are kept in memory between the requests so that a request on a known mesh
+only cost the assembly of the right hand side and one back substitution.
+Solver_service.serve(address) answer the requests sent on a local Unix socket (multiprocessing.connection), Solver_client send them.
+A request is a dictionary :
+    'mesh' : {'coordinates' : array, 'cells' : array} (only needed the first time, the reply hold its fingerprint) or 'fingerprint' : str
+    'sources' : {'fe0' : value, ...}, value is either the dof array of the source in the corresponding space F0, F1, ... or the string(s) of an Expression
+The reply is {'fingerprint' : str, 'solution' : dof array in the mixed space W}, {'fingerprint' : str, 'status' : 'unknown_mesh'} when the mesh is not known
+(never sent or evicted, the client then send it again) or {'error' : str}.
+The meshes are kept in a LRU bounded by memory_budget (in bytes, measured as the growth of the resident memory while the mesh is set up).
+Run as a script : python BTservice.py address [--dim 3] [--dbc] [--memory MB]
+"""
+
+from dolfin import *
+import numpy as np
+import hashlib
+import os
+import traceback
+from collections import OrderedDict
+from multiprocessing.connection import Listener, Client
+from BTcontext import Mesh_context
+
+class Unknown_mesh(Exception):
+    pass
+
+def mesh_fingerprint(coordinates,cells):
+    h = hashlib.sha1()
+    for a in (np.ascontiguousarray(coordinates,dtype=np.float64),np.ascontiguousarray(cells,dtype=np.int64)):
+        h.update(str(a.shape).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+def mesh_from_arrays(coordinates,cells):
+    coordinates = np.asarray(coordinates,dtype=np.float64)
+    cells = np.asarray(cells,dtype=np.uintp)
+    tdim = cells.shape[1] - 1
+    mesh = Mesh()
+    editor = MeshEditor()
+    editor.open(mesh,{2 : 'triangle', 3 : 'tetrahedron'}[tdim],tdim,coordinates.shape[1])
+    editor.init_vertices(len(coordinates))
+    editor.init_cells(len(cells))
+    for (i,x) in enumerate(coordinates):
+        editor.add_vertex(i,x)
+    for (i,c) in enumerate(cells):
+        editor.add_cell(i,c)
+    editor.close()
+    return mesh
+
+def resident_memory():
+    # current resident memory in bytes (Linux)
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+
+class Solver_service:
+    """
+    solver_class is BiotSavart_harmonic of BTsolver_2D or BTsolver_3D, DBC, Elemdict and Tunning are set on each solver and init_kwargs passed to init_mesh
+    (search_harmonics, number_of_void_and_tunnel, ...).
+    """
+    def __init__(self,solver_class,DBC=False,Elemdict=None,Tunning={},memory_budget=None,init_kwargs={}):
+        self.solver_class = solver_class
+        self.DBC = DBC
+        self.Elemdict = Elemdict
+        self.Tunning = Tunning
+        self.memory_budget = memory_budget
+        self.init_kwargs = init_kwargs
+        self.solvers = OrderedDict() # fingerprint : (solver, memory), least recently used first
+        self.memory = 0
+
+    def get_solver(self,fingerprint,mesh_arrays=None):
+        if fingerprint in self.solvers:
+            self.solvers.move_to_end(fingerprint)
+            return self.solvers[fingerprint][0]
+        if mesh_arrays is None:
+            raise Unknown_mesh("Unknown mesh {}, send its coordinates and cells".format(fingerprint))
+        before = resident_memory()
+        mesh = mesh_from_arrays(mesh_arrays['coordinates'],mesh_arrays['cells'])
+        if self.Elemdict is not None:
+            solver = self.solver_class(DBC=self.DBC,Elemdict=self.Elemdict)
+        else:
+            solver = self.solver_class(DBC=self.DBC)
+        solver.Tunning = dict(self.Tunning)
+        # the operator is assembled ahead of the solves so that its factorization is reused, the private context keep no other copy
+        solver.init_mesh(mesh,context=Mesh_context(mesh,private=True),**self.init_kwargs)
+        solver.interpolate()
+        solver.solve()
+        size = max(resident_memory() - before,0)
+        self.solvers[fingerprint] = (solver,size)
+        self.memory += size
+        while (self.memory_budget is not None) and (self.memory > self.memory_budget) and (len(self.solvers) > 1):
+            (evicted,(old,oldsize)) = self.solvers.popitem(last=False)
+            self.memory -= oldsize
+            print("Evicting mesh {}".format(evicted))
+        return solver
+
+    def set_sources(self,solver,sources):
+        names = [name for name in ('fe0','fe1','fe2','fe3') if hasattr(solver,name)]
+        arrays = {}
+        for (k,name) in enumerate(names):
+            value = sources.get(name)
+            if isinstance(value,np.ndarray):
+                arrays[k] = value
+                value = None
+            if value is None:
+                shape = getattr(solver,'fa{}'.format(k)).ufl_shape
+                value = "0" if len(shape) == 0 else tuple(["0"]*shape[0])
+            setattr(solver,name,Expression(value,degree=2))
+        solver.interpolate()
+        for (k,value) in arrays.items():
+            fa = getattr(solver,'fa{}'.format(k))
+            fa.vector().set_local(value)
+            fa.vector().apply("insert")
+        if (len(arrays) > 0):
+            solver.assign()
+
+    def handle(self,request):
+        try:
+            if 'mesh' in request:
+                fingerprint = mesh_fingerprint(request['mesh']['coordinates'],request['mesh']['cells'])
+            else:
+                fingerprint = request['fingerprint']
+            solver = self.get_solver(fingerprint,request.get('mesh'))
+            self.set_sources(solver,request.get('sources',{}))
+            return {'fingerprint' : fingerprint, 'solution' : solver.solve().vector().get_local()}
+        except Unknown_mesh:
+            return {'fingerprint' : fingerprint, 'status' : 'unknown_mesh'}
+        except Exception as e:
+            traceback.print_exc()
+            return {'error' : repr(e)}
+
+    def serve(self,address,authkey=None):
+        """
+        Answer the requests until a client send 'shutdown'.
+        """
+        with Listener(address,family='AF_UNIX',authkey=authkey) as listener:
+            running = True
+            while running:
+                with listener.accept() as conn:
+                    while True:
+                        try:
+                            request = conn.recv()
+                        except EOFError:
+                            break
+                        if (request == 'shutdown'):
+                            running = False
+                            break
+                        conn.send(self.handle(request))
+
+class Solver_client:
+    def __init__(self,address,authkey=None):
+        self.conn = Client(address,family='AF_UNIX',authkey=authkey)
+        self.fingerprints = set()
+
+    def solve(self,sources,coordinates=None,cells=None):
+        """
+        Return the dof array of the solution, the mesh is only sent when the service does not know it yet.
+        """
+        fingerprint = mesh_fingerprint(coordinates,cells)
+        if fingerprint in self.fingerprints:
+            self.conn.send({'fingerprint' : fingerprint, 'sources' : sources})
+            reply = self.conn.recv()
+            if (reply.get('status') == 'unknown_mesh'):
+                # evicted by the service, send the mesh again (once)
+                self.fingerprints.discard(fingerprint)
+        if fingerprint not in self.fingerprints:
+            self.conn.send({'mesh' : {'coordinates' : coordinates, 'cells' : cells}, 'sources' : sources})
+            reply = self.conn.recv()
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        self.fingerprints.add(fingerprint)
+        return reply['solution']
+
+    def shutdown(self):
+        self.conn.send('shutdown')
+        self.conn.close()
+
+    def close(self):
+        self.conn.close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve BiotSavart_harmonic solves on a Unix socket")
+    parser.add_argument("address")
+    parser.add_argument("--dim",type=int,default=2)
+    parser.add_argument("--dbc",action="store_true")
+    parser.add_argument("--memory",type=float,default=None,help="memory budget in MB")
+    args = parser.parse_args()
+    if (args.dim == 2):
+        from BTsolver_2D import BiotSavart_harmonic
+    else:
+        from BTsolver_3D import BiotSavart_harmonic
+    budget = None if args.memory is None else args.memory*2**20
+    Solver_service(BiotSavart_harmonic,DBC=args.dbc,memory_budget=budget).serve(args.address)
@@ -1,11 +1,25 @@
 from dolfin import *
 import numpy as np
+from BTsuperposition import Superposition_cache
+from BTio import Solution_writer
+from BTdec import DEC_applicable, assemble_DEC
+from BTcontext import Mesh_context
+from BTasync import get_executor, completed
+from BTprecision import Mixed_precision_LU
+from BTcondense import Static_condensation
+from BTbridge import as_operator, peak_memory
+from BTordering import Reordered_LU
+from BTnullspace import null_space_solver, null_space_job, polish_harmonic_basis
+from BTcommon import lowest_order_elements, assemble_harmonic_search, dorfler_marking, boundary_whole
+from BTerror import invalidate_projectors
+from petsc4py import PETSc
+from scipy.sparse.linalg import splu
 
 class BiotSavart_harmonic:
     """
     Set DBC to true to solve with essential boundary condition
     Set Elemdict to override default elem, dictionary of the form {0f : {form : 'trimmed', degree : 1},1f ... }, trimmed and full are supported. No check are performed to ensure coherency of degrees.
-    First call init_mesh(mesh,search_harmonics=True,expected_harmonics=2,printvp=False,customthreshold=1e-15,imported=None) 
+    First call init_mesh(mesh,search_harmonics=True,expected_harmonics=2,printvp=False,customthreshold=1e-15,imported=None,context=None) 
          search_harmonics take time and should be disable when the domain is simply connected
          Custom parameter may be passed to the solver by editing the dictionnary "Tunning" before calling this function
          customthreshold set the value at which a singular value (or eigen value) is treated as 0, set printvp to display found value.
@@ -13,17 +27,49 @@ class BiotSavart_harmonic:
          It can be generated by export_harmonic(). fh1 is an array of lenght n of Function on the harmonic space.
          Beware that harmonics depends greatly on mesh, they shouldn't be imported from a mesh with different raffinement and also depend on the boundary condition. Use this with care as no check are implemented and incorrect data will silently corrupt the solver.
          The safest way to export might be to save in a file rather than using pickle and also get the mesh from the same file.
+         context is a Mesh_context shared by the solvers of the different boundary conditions on the same mesh, the spaces and the derivative blocks are then built once.
+         When harmonics are searched without context, a private one is used so that the solver reuse the spaces, the harmonic functions and the derivative blocks of the search.
     
     Supported option for Tunning are :
-    Tunning["solver"] == "SLEPc_SVD", "SuiteSparse_QR", "Scipy_eigs"
+    Tunning["solver"] == "SLEPc_SVD", "SuiteSparse_QR", "Scipy_eigs", "LOBPCG"
         When using "SLEPc_SVD", Tunning["ncv"] and Tunning["mpd"] dictate to corresponding parameter in the library (when both are set at the same time, else they are ignored).
         When using "Scipy_eigs" Tunning["eigs_tol"] is available (ncv is also supported by the algorithm but the warpper isn't done yet, this should be easy to add).
+        When using "LOBPCG" (no factorization, for memory constrained nodes) Tunning["lobpcg_tol"], Tunning["lobpcg_block"] (default expected + 2) and Tunning["lobpcg_maxiter"]
+            are available, the preconditioner is an AMG cycle on A^2 (Tunning["lobpcg_preconditioner"] == "pyamg" or "gamg", default pyamg when installed),
+            "jacobi" (diagonal of A^2) or "none", and the dimension is always found by the spectral gap (see "adaptive").
+            The AMG hierarchy is built on the assembled A^2, whose number of nonzeros is several times the one of A, use "jacobi" to stay in O(nnz(A) + N*block).
+    Tunning["adaptive"] == True replace the fixed threshold by the detection of a spectral gap : values are requested Tunning["block"] (default 2) at a time
+        and the search stop at the first relative jump larger than Tunning["gap"] (default 1e4), or after Tunning["max_harmonics"] values. The size of the jump is reported.
+        Only the values below a cutoff tied to the accuracy of the solver (100 times its tolerance relative to the norm of the operator) may be in the null space,
+        the null space is trivial when the first value is above it. Tunning["zero_threshold"] set this cutoff (absolute value).
+    Tunning["memory_report"] == True print the peak memory of the process before and after the harmonic search.
+    Tunning["assembly"] == "DEC" assemble the operator (of the harmonic search and of the solver) from the incidence matrices of the mesh, only the mass matrices
+        are assembled by FEniCS. This require trimmed elements of degree 1 (the default) and work only in serial, see BTdec.
+    Tunning["precision"] == "mixed" factorize the operator in single precision (about half the memory) and refine the solution in double precision,
+        up to Tunning["refinement_steps"] (default 10) steps or a relative residual of Tunning["refinement_tol"] (default 1e-12).
+        The usual factorization is used when the refinement stall. Only in serial, see BTprecision.
+    Tunning["condensation"] == True eliminate the cell interior dofs (useful at degree 2 and more) with batched local solves before factorizing the remaining system,
+        only in serial, see BTcondense.
+    Tunning["p_multilevel"] == True search the harmonics with the trimmed elements of degree 1 and lift them to the elements of Elemdict (useful at degree 2 and more),
+        they are polished by LOBPCG seeded with the lifted basis (no factorization of the high order operator, the preconditioner is the one of "LOBPCG"),
+        or by Tunning["p_multilevel_steps"] (default 3) steps of inverse iteration with Tunning["polish"] == "lu". Not used by init_mesh_async.
+    Tunning["polish"] == "lu" refine the known harmonics (update_coordinates, init_mesh_transfer, "p_multilevel") by inverse iteration with a factorization of the operator of the search,
+        by default they are refined by LOBPCG seeded with the known basis (no factorization, the preconditioner is the one of "LOBPCG" and is reused between the updates).
+    Tunning["ordering"] == "nested_dissection" or "rcm" factorize a permutation of the operator with the Real dofs last (nested dissection need pymetis),
+        in solve(). Tunning["ordering_report"] == True print the fill and the time of the factorization against the default LUSolver and the default SuperLU ordering.
+        The "SuiteSparse_QR" search keep the column ordering of SPQR (sparseqr does not accept a given one). See BTordering.
     
     Set fe0 and fe2 to desired value
     Call interpolate()
     Then all solve variant are available
     solve() return a function in the mixed space
     solve_1_form_dual() return a vector field
+    estimate_error(usol) return the element-wise residual indicators of a solution given by solve(), see also adaptive_solve()
+    register_basis_sources(sources) precompute the responses to a set of basis sources, solve_combination(coeffs) then return any linear combination of them without solving (see Superposition_cache)
+    init_mesh_async(mesh,...) start the harmonic search in the background and return a future, interpolate() may be called meanwhile and solve() wait for the search (see BTasync)
+    init_mesh_transfer(mesh,fh1) initialise on a refined mesh from the harmonic basis fh1 of the parent mesh (used by adaptive_solve)
+    update_coordinates(coordinates) update the operator and the harmonics after the vertices moved (same connectivity), keeping the spaces and the symbolic factorization
+    open_writer(filename) return a Solution_writer storing the mesh once and then the solutions appended to it in a single HDF5/XDMF file
     """
     def __init__(self,DBC=False,Elemdict = {
         '0f' : {'form' : 'trimmed', 'degree' : 1}, '1f' : {'form' : 'trimmed', 'degree' : 1}, 
@@ -56,6 +102,10 @@ class BiotSavart_harmonic:
         
         self.DBC = DBC
         self.Tunning = {}
+        self.superposition = None
+        self.pending = None
+        self.context = None
+        self.harmonic_preconditioner = None
     
     def export_harmonic(self):
         return {'n' : self.n1,'fh1' : self.fh1}
@@ -66,18 +116,82 @@ class BiotSavart_harmonic:
         for i in range(self.n1):
             Lu1.append(project(harmonics['fh1'][i], self.F1))
         return Lu1
-    def init_mesh(self,mesh,search_harmonics=False,expected_harmonics=2,printvp=False,customthreshold=1e-15,imported=None):
+    def init_mesh(self,mesh,search_harmonics=False,expected_harmonics=2,printvp=False,customthreshold=1e-15,imported=None,context=None):
         self.mesh = mesh
         Lu1 = []
         if (search_harmonics):
             if imported is not None and 'n' in imported:
                 self.n1 = imported['n']
             else:
+                if context is None:
+                    # the spaces and the derivative blocks of the search are reused by the solver
+                    context = Mesh_context(self.mesh,private=True)
                 self.n1 = get_harmonic1_basis(self.mesh,Lu1,DBC=self.DBC,Elemdict=self.Elemdict,
                                               Tunning=self.Tunning,expected_harmonics=expected_harmonics,
-                                              printvp=printvp,customthreshold=customthreshold)
+                                              printvp=printvp,customthreshold=customthreshold,context=context)
         else:
             self.n1 = 0
+        self.pending = None
+        self.finish_init_mesh(Lu1,imported=imported,context=context)
+    
+    def init_mesh_transfer(self,mesh,fh1,context=None):
+        """
+        Same as init_mesh with the harmonics transferred from fh1, the harmonic basis of a solver on a parent mesh (mesh is a refinement of it) : no search is done,
+        see transfer_harmonic1_basis.
+        """
+        self.mesh = mesh
+        if context is None:
+            context = Mesh_context(self.mesh,private=True)
+        Lu1 = []
+        self.n1 = transfer_harmonic1_basis(self.mesh,fh1,Lu1,DBC=self.DBC,Elemdict=self.Elemdict,Tunning=self.Tunning,context=context)
+        self.pending = None
+        self.finish_init_mesh(Lu1,context=context)
+    
+    def init_mesh_async(self,mesh,search_harmonics=False,expected_harmonics=2,printvp=False,customthreshold=1e-15,context=None,executor=None):
+        """
+        Same as init_mesh but the null space solver of the harmonic search run in executor (default : the shared process pool of BTasync, see set_worker_budget),
+        the operator is sent to the worker as CSR arrays (see null_space_job in BTnullspace, the workers only import PETSc and scipy).
+        Return a concurrent.futures.Future. The spaces of the sources are taken from the context right away so that fe0, fe1, fe2 can be set and interpolate() called
+        while the search is running, the initialisation is completed by wait(), which is called by solve().
+        """
+        self.mesh = mesh
+        self.pending = None
+        if not (search_harmonics):
+            self.init_mesh(mesh,search_harmonics=False,context=context)
+            return completed(0)
+        if context is None:
+            context = Mesh_context(self.mesh,private=True)
+        (biot_savart_solver,operator) = assemble_harmonic_search(BiotSavart_base,self.mesh,DBC=self.DBC,Elemdict=self.Elemdict,Tunning=self.Tunning,context=context)
+        csr = operator.csr()
+        future = get_executor(executor).submit(null_space_job,(csr.data,csr.indices,csr.indptr),csr.shape,Tunning=dict(self.Tunning),
+                                               expected_harmonics=expected_harmonics,printvp=printvp,customthreshold=customthreshold)
+        del csr,operator # the worker has its own copy
+        self.pending = (biot_savart_solver,future,expected_harmonics,context)
+        self.fa0 = Function(context.function_space(self.Elemf0))
+        self.fa1 = Function(context.function_space(self.Elemf1))
+        self.fa2 = Function(context.function_space(self.Elemf2))
+        return future
+    
+    def wait(self):
+        """
+        Join the harmonic search started by init_mesh_async and complete the initialisation, does nothing otherwise.
+        """
+        if self.pending is None:
+            return
+        (biot_savart_solver,future,expected_harmonics,context) = self.pending
+        self.pending = None
+        Lu1 = []
+        self.n1 = extract_harmonic1_basis(biot_savart_solver,future.result(),Lu1,expected_harmonics)
+        early = (self.fa0,self.fa1,self.fa2)
+        self.finish_init_mesh(Lu1,context=context)
+        # the sources interpolated meanwhile are already on the spaces of the context
+        (self.fa0,self.fa1,self.fa2) = early
+        self.assign()
+    
+    def finish_init_mesh(self,Lu1,imported=None,context=None):
+        self.harmonic_preconditioner = None # built for the pattern of the previous mesh
+        if self.superposition is not None:
+            self.superposition.invalidate()
         # We must postpone space definition as they now depend on mesh
         self.PH1 = []
         self.EPH1 = None
@@ -90,21 +204,20 @@ class BiotSavart_harmonic:
         else:
             self.TH = MixedElement([self.Elemf0,self.Elemf1,self.Elemf2,self.PH])
         #
-        self.W = FunctionSpace(self.mesh, self.TH)
-        self.F0 = FunctionSpace(self.mesh,self.Elemf0)
-        self.F1 = FunctionSpace(self.mesh,self.Elemf1)
-        self.F2 = FunctionSpace(self.mesh,self.Elemf2)
-        self.FPH = FunctionSpace(self.mesh,self.PH)
-        self.FPH1 = None
-        if (self.n1 > 0):
-            self.FPH1 = FunctionSpace(self.mesh,self.EPH1)
+        if context is not None:
+            context.set_spaces(self)
+        else:
+            self.set_spaces()
         self.f = Function(self.W)
-        self.fh1 = []
-        for i in range(self.n1):
-            self.fh1.append(Function(self.F1))
         if imported is not None:
             Lu1 = self.import_harmonic(imported)
-        self.set_harmonic_basis(Lu1)
+        self.fh1 = []
+        for i in range(self.n1):
+            if (Lu1[i].function_space() == self.F1):
+                self.fh1.append(Lu1[i]) # found on the same space (shared by a context), no copy
+            else:
+                self.fh1.append(Function(self.F1))
+                self.fh1[i].assign(Lu1[i])
         self.dbc = []
         if (self.DBC):
             (self.a,self.L) = self.set_problem_DBC(self.W,self.f,self.fh1)
@@ -112,6 +225,9 @@ class BiotSavart_harmonic:
                                            DirichletBC(self.W.sub(1), Constant((0.,0.)), boundary_whole)]
         else:
             (self.a,self.L) = self.set_problem(self.W,self.f,self.fh1)
+        self.context = context
+        self.A = self.assemble_operator()
+        self.lu = None
         self.assigner = None
         self.fah1 = None
         if (self.n1 > 0):
@@ -123,12 +239,85 @@ class BiotSavart_harmonic:
         self.fa1 = Function(self.F1)
         self.fa2 = Function(self.F2)
         self.fah = Function(self.FPH)
-        
+    
+    def assemble_operator(self,force=False):
+        """
+        Return the operator with its boundary conditions when it is assembled ahead of the solves (DEC, context, custom factorization or force), None otherwise.
+        """
+        A = None
+        if ("assembly" in self.Tunning) and (self.Tunning["assembly"] == "DEC") and not DEC_applicable(self.Elemdict):
+            print("DEC assembly require trimmed elements of degree 1, using the generic assembly")
+        if ("assembly" in self.Tunning) and (self.Tunning["assembly"] == "DEC") and DEC_applicable(self.Elemdict):
+            A = assemble_DEC(self.W,self.mesh,self.fh1,self.DBC)
+        elif self.context is not None:
+            A = self.context.assemble(self,('harmonic',self.n1),self.fh1)
+        elif (force) or (self.mixed_precision() or self.condensation() or self.reordering()):
+            A = assemble(self.a)
+        if A is not None:
+            for bc in self.dbc:
+                bc.apply(A)
+        if self.context is not None:
+            self.context.release()
+        return A
+    
+    def update_coordinates(self,coordinates=None,inverse_iterations=3,invalidate=True):
+        """
+        Update the solver after a displacement of the vertices (the connectivity must not change), coordinates replace mesh.coordinates() when given.
+        The spaces, the number of harmonics and the sparsity pattern are kept : the operator is assembled again and copied into the same matrix,
+        so that LUSolver only redo the numeric factorization (PETSc keep the symbolic one while the pattern does not change).
+        Reordered_LU keep its permutation but SuperLU redo the symbolic factorization, the other custom factorizations are rebuilt by the next solve().
+        The harmonic basis is refined on the operator of the search starting from the previous basis (see polish_harmonic_basis), the preconditioner is built
+        on the first update and reused by the next ones so that no factorization of the search operator is done (inverse_iterations is used with Tunning["polish"] == "lu").
+        """
+        self.wait()
+        if coordinates is not None:
+            self.mesh.coordinates()[:] = coordinates
+        self.mesh.bounding_box_tree().build(self.mesh)
+        invalidate_projectors(self.mesh)
+        if (self.context is not None) and (invalidate):
+            self.context.invalidate()
+        if (self.n1 > 0):
+            (biot_savart_solver,operator) = assemble_harmonic_search(BiotSavart_base,self.mesh,DBC=self.DBC,Elemdict=self.Elemdict,Tunning=self.Tunning,context=self.context)
+            Solver = polish_harmonic_basis(operator,harmonic_seeds(biot_savart_solver,self.fh1),Tunning=self.Tunning,
+                                           steps=inverse_iterations,preconditioner=self.harmonic_preconditioner)
+            self.harmonic_preconditioner = Solver.M
+            Lu1 = []
+            extract_harmonic1_basis(biot_savart_solver,Solver,Lu1,self.n1)
+            for i in range(self.n1):
+                self.fh1[i].assign(Lu1[i])
+        A = self.assemble_operator(force=True)
+        if (self.A is not None) and isinstance(self.lu,LUSolver):
+            self.A.zero()
+            self.A.axpy(1.,A,True)
+        else:
+            if isinstance(self.lu,Reordered_LU):
+                self.lu = Reordered_LU(A,self.W,perm=self.lu.perm)
+            else:
+                self.lu = None
+            self.A = A
+        if self.superposition is not None:
+            self.superposition.invalidate()
+    
+    def set_spaces(self,space=None):
+        if space is None:
+            space = lambda element : FunctionSpace(self.mesh,element)
+        self.W = space(self.TH)
+        self.F0 = space(self.Elemf0)
+        self.F1 = space(self.Elemf1)
+        self.F2 = space(self.Elemf2)
+        self.FPH = space(self.PH)
+        self.FPH1 = None
+        if (self.n1 > 0):
+            self.FPH1 = space(self.EPH1)
         
     def interpolate(self):
         self.fa0.interpolate(self.fe0)
         self.fa1.interpolate(self.fe1)
         self.fa2.interpolate(self.fe2)
+        if self.pending is None:
+            self.assign()
+    
+    def assign(self):
         if (self.n1 > 0):
             self.assigner.assign(self.f, [self.fa0, self.fa1, self.fa2, self.fah, self.fah1])
         else:
@@ -139,64 +328,152 @@ class BiotSavart_harmonic:
             self.fh1[i].assign(u[i])
     
     def solve(self):
+        self.wait()
         usol = Function(self.W)
-        solve(self.a == self.L,usol,self.dbc)
+        if self.A is not None:
+            b = assemble(self.L)
+            for bc in self.dbc:
+                bc.apply(b)
+            if (self.lu is None) and (self.condensation()):
+                self.lu = Static_condensation(self.A,self.W,self.mesh)
+            elif (self.lu is None) and (self.reordering()):
+                self.lu = Reordered_LU(self.A,self.W,method=self.Tunning["ordering"],report=self.Tunning.get("ordering_report",False))
+            elif (self.lu is None) and (self.mixed_precision()):
+                self.lu = Mixed_precision_LU(self.A,tol=self.Tunning.get("refinement_tol",1e-12),
+                                             max_steps=self.Tunning.get("refinement_steps",10))
+            elif self.lu is None:
+                self.lu = LUSolver(self.A)
+            self.lu.solve(usol.vector(),b)
+        else:
+            solve(self.a == self.L,usol,self.dbc)
         return usol
     
     def solve_1_form_dual(self):
-        usol = Function(self.W)
-        solve(self.a == self.L,usol,self.dbc)
+        usol = self.solve()
         B = project(as_vector((usol.sub(1)[1],-usol.sub(1)[0])), self.F1)
         return B
     
-    def set_problem(self,W,f,fh1):
+    def mixed_precision(self):
+        return ("precision" in self.Tunning) and (self.Tunning["precision"] == "mixed")
+    
+    def condensation(self):
+        return ("condensation" in self.Tunning) and (self.Tunning["condensation"])
+    
+    def reordering(self):
+        return ("ordering" in self.Tunning) and (self.Tunning["ordering"] is not None)
+    
+    def register_basis_sources(self,sources,memory_budget=None,directory=None):
+        """
+        sources is a dictionary {key : {'fe0' : Expression, ...}}, see Superposition_cache for the other parameters.
+        """
+        self.wait()
+        self.superposition = Superposition_cache(self,memory_budget=memory_budget,directory=directory)
+        for key in sources:
+            self.superposition.register(key,sources[key])
+        return self.superposition
+    
+    def solve_combination(self,coeffs):
+        return self.superposition.solve_combination(coeffs)
+    
+    def open_writer(self,filename,chunk=64,compression=None,capacity=None):
+        self.wait()
+        return Solution_writer(self,filename,chunk=chunk,compression=compression,capacity=capacity)
+    
+    def estimate_error(self,usol):
+        """
+        Residual based a posteriori estimator for usol (a function in the mixed space returned by solve()).
+        Return an array of the squared indicators, one per cell in the mesh ordering (the owned cells of the process in parallel).
+        The residuals of the three equations are weighted by h^2, h^2 and 1 and completed by the jumps of the normal trace of u_1 and of u_2 over the facets.
+        """
+        DG0 = FunctionSpace(self.mesh,'DG',0)
+        w = TestFunction(DG0)
+        h = CellDiameter(self.mesh)
+        n = FacetNormal(self.mesh)
+        if (self.n1 >0):
+            (u_0,u_1,u_2,u_p,u_p1) = split(usol)
+        else:
+            (u_0,u_1,u_2,u_p) = split(usol)
+        R0 = self.fe0 + u_1[0].dx(0) + u_1[1].dx(1)
+        R1 = self.fe1 - as_vector((u_0.dx(0) + u_2.dx(1),u_0.dx(1) - u_2.dx(0)))
+        for i in range(self.n1):
+            R1 = R1 - u_p1[i]*self.fh1[i]
+        R2 = self.fe2 - (u_1[1].dx(0) - u_1[0].dx(1))
+        if (self.DBC):
+            R2 = R2 - u_p
+        else:
+            R0 = R0 - u_p
+        eta = w*(h**2*R0**2 + h**2*inner(R1,R1) + R2**2)*dx + avg(w)*avg(h)*(jump(u_1,n)**2 + jump(u_2)**2)*dS
+        if not (self.DBC):
+            # u_1.n and u_2 vanish weakly on the boundary
+            eta = eta + w*h*(inner(u_1,n)**2 + u_2**2)*ds
+        # the values are stored in the DG0 dof ordering, read them back cell by cell (owned cells only, they come first)
+        values = assemble(eta).get_local()
+        tdim = self.mesh.topology().dim()
+        cell_dofs = DG0.dofmap().entity_dofs(self.mesh,tdim)
+        return values[cell_dofs[:self.mesh.topology().ghost_offset(tdim)]]
+    
+    def set_derivative(self,W):
         if (self.n1 >0):
             (u_0,u_1,u_2,u_p,u_p1) = TrialFunctions(W)
             (v_0,v_1,v_2,v_q,v_q1) = TestFunctions(W)
-            (f_0,f_1,f_2,f_h,f_h1) = split(f)
         else:
             (u_0,u_1,u_2,u_p) = TrialFunctions(W)
             (v_0,v_1,v_2,v_q) = TestFunctions(W)
-            (f_0,f_1,f_2,f_h) = split(f)
         a1 = u_0.dx(0)*v_1[0]*dx + u_0.dx(1)*v_1[1]*dx + (u_1[1].dx(0) - u_1[0].dx(1))*v_2*dx
         a2 = v_0.dx(0)*u_1[0]*dx + v_0.dx(1)*u_1[1]*dx + (v_1[1].dx(0) - v_1[0].dx(1))*u_2*dx
-        ah = u_p*v_0*dx + u_0*v_q*dx
-        for i in range(self.n1):
-            ah = ah + u_p1[i]*inner(fh1[i],v_1)*dx + v_q1[i]*inner(fh1[i],u_1)*dx
-        a = a1 + a2 + ah
-        L = f_0*v_0*dx + f_1[0]*v_1[0]*dx + f_1[1]*v_1[1]*dx + f_2*v_2*dx
-        return (a,L)
+        return a1 + a2
     
-    def set_problem_DBC(self,W,f,fh1):
+    def set_coupling(self,W,fh1,DBC):
         if (self.n1 >0):
             (u_0,u_1,u_2,u_p,u_p1) = TrialFunctions(W)
             (v_0,v_1,v_2,v_q,v_q1) = TestFunctions(W)
-            (f_0,f_1,f_2,f_h,f_h1) = split(f)
         else:
             (u_0,u_1,u_2,u_p) = TrialFunctions(W)
             (v_0,v_1,v_2,v_q) = TestFunctions(W)
-            (f_0,f_1,f_2,f_h) = split(f)
-        a1 = u_0.dx(0)*v_1[0]*dx + u_0.dx(1)*v_1[1]*dx + (u_1[1].dx(0) - u_1[0].dx(1))*v_2*dx
-        a2 = v_0.dx(0)*u_1[0]*dx + v_0.dx(1)*u_1[1]*dx + (v_1[1].dx(0) - v_1[0].dx(1))*u_2*dx
-        ah = u_p*v_2*dx + u_2*v_q*dx
+        if (DBC):
+            ah = u_p*v_2*dx + u_2*v_q*dx
+        else:
+            ah = u_p*v_0*dx + u_0*v_q*dx
         for i in range(self.n1):
             ah = ah + u_p1[i]*inner(fh1[i],v_1)*dx + v_q1[i]*inner(fh1[i],u_1)*dx
-        a = a1 + a2 + ah
+        return ah
+    
+    def set_rhs(self,W,f):
+        if (self.n1 >0):
+            (v_0,v_1,v_2,v_q,v_q1) = TestFunctions(W)
+            (f_0,f_1,f_2,f_h,f_h1) = split(f)
+        else:
+            (v_0,v_1,v_2,v_q) = TestFunctions(W)
+            (f_0,f_1,f_2,f_h) = split(f)
         L = f_0*v_0*dx + f_1[0]*v_1[0]*dx + f_1[1]*v_1[1]*dx + f_2*v_2*dx
+        return L
+    
+    def set_problem(self,W,f,fh1):
+        a = self.set_derivative(W) + self.set_coupling(W,fh1,False)
+        L = self.set_rhs(W,f)
+        return (a,L)
+    
+    def set_problem_DBC(self,W,f,fh1):
+        a = self.set_derivative(W) + self.set_coupling(W,fh1,True)
+        L = self.set_rhs(W,f)
         return (a,L)
 
 class BiotSavart_harmonic_restrict:
     """
-    As of now depreciated
-    This version use a restricted space for trial and test function.
+    This version use a restricted space for trial and test function : the trial space is (1-form, Real) and the test space (0-form, 2-form, harmonics),
+    the auxiliary 0 and 2-forms of BiotSavart_harmonic are not computed. By Euler's formula the resulting system is square (V + F + n1 equations for E + 1 unknowns,
+    with or without DBC) when n1 is the number of holes of the domain, it is factorized once and the factorization is reused by every subsequent solve on the same mesh.
+    A RuntimeError is raised when the system is not square, i.e. when search_harmonics is False on a multiply connected domain (or the search missed harmonics).
     Set DBC to true to solve with essential boundary condition
-    First call init_mesh(mesh,search_harmonics=True) search_harmonics take time and should be disable when the domain is simply connected
+    First call init_mesh(mesh,search_harmonics=True,expected_harmonics=2,printvp=False,customthreshold=1e-15)
+         search_harmonics take time and should be disable when the domain is simply connected
+         The harmonic forms are computed by get_harmonic1_basis, the dictionnary "Tunning" is passed to it (see BiotSavart_harmonic).
     Set fe0 and fe2 to desired value
     Call interpolate()
     Then all solve variant are available
-    solve() return a function in the mixed space
-    solve_1_form_dual() return a vector field (does not work for now)
-    solve_DBC() and solve_1_form_dual_DBC() solve for a essential boundary condition (does not work for now)
+    solve() return a function in the mixed space (1-form, Real)
+    solve_1_form_dual() return a vector field
+    The system is assembled as a scipy matrix, this only work in serial.
     """
     def __init__(self,DBC=False):
         
@@ -209,77 +486,111 @@ class BiotSavart_harmonic_restrict:
         self.fe2 = Expression("0", degree=2)
         
         self.DBC = DBC
-        if(DBC):
-            print("Dirichlet boundary not yet implemented")
-            raise NotImplementedError
+        self.Tunning = {}
         
-    def init_mesh(self,mesh,search_harmonics=True,printvp=False,customthreshold=1e-15):
+    def init_mesh(self,mesh,search_harmonics=True,expected_harmonics=2,printvp=False,customthreshold=1e-15):
         self.mesh = mesh
         Lu1 = []
         if (search_harmonics):
             # When using mixed BC care must be taken to determine harmonic forms as they are no longer linked to te surface genus
-            self.n1 = get_harmonic1_basis_legacy(self.mesh,Lu1,self.DBC,printvp,customthreshold)
+            self.n1 = get_harmonic1_basis(self.mesh,Lu1,DBC=self.DBC,Tunning=self.Tunning,expected_harmonics=expected_harmonics,
+                                          printvp=printvp,customthreshold=customthreshold)
         else:
             self.n1 = 0
         # We must postpone space definition as they now depend on mesh
         self.PH1 = []
-        for i in range(self.n1):
-            self.PH1.append(FiniteElement('Real', cell='triangle', degree=0)) #Hold coeff for basis of harmonic 1-forms
-        self.EPH1 = MixedElement(self.PH1)
-        self.TH = MixedElement([self.Elemf0,self.Elemf1,self.Elemf2,self.PH,self.EPH1])
-        # Asym
+        self.EPH1 = None
         self.TH1 = MixedElement([self.Elemf1,self.PH])
-        self.TH2 = MixedElement([self.Elemf0,self.Elemf2,self.EPH1])
+        if (self.n1 > 0):
+            for i in range(self.n1):
+                self.PH1.append(FiniteElement('Real', cell='triangle', degree=0)) #Hold coeff for basis of harmonic 1-forms
+            self.EPH1 = MixedElement(self.PH1)
+            self.TH2 = MixedElement([self.Elemf0,self.Elemf2,self.EPH1])
+        else:
+            self.TH2 = MixedElement([self.Elemf0,self.Elemf2])
         #
-        self.W = FunctionSpace(self.mesh, self.TH)
         self.W1 = FunctionSpace(self.mesh,self.TH1)
         self.W2 = FunctionSpace(self.mesh,self.TH2)
         self.F0 = FunctionSpace(self.mesh,self.Elemf0)
         self.F1 = FunctionSpace(self.mesh,self.Elemf1)
         self.F2 = FunctionSpace(self.mesh,self.Elemf2)
-        self.FPH = FunctionSpace(self.mesh,self.PH)
-        self.FPH1 = FunctionSpace(self.mesh,self.EPH1)
+        self.FPH1 = None
+        if (self.n1 > 0):
+            self.FPH1 = FunctionSpace(self.mesh,self.EPH1)
         self.f = Function(self.W2)
         self.fh1 = []
         for i in range(self.n1):
             self.fh1.append(Function(self.F1))
         self.set_harmonic_basis(Lu1)
-        self.dbc = []
+        # Essential conditions remove the boundary dofs of the 0-form test functions (rows) and of the 1-form unknowns (columns)
+        self.rows = np.arange(self.W2.dim())
+        self.cols = np.arange(self.W1.dim())
         if (self.DBC):
             (self.a,self.L) = self.set_problem_DBC(self.W1,self.W2,self.f,self.fh1)
-            self.dbc = [DirichletBC(self.W2.sub(0), Constant(0.), boundary_whole),
-                                           DirichletBC(self.W1.sub(0), Constant((0.,0.)), boundary_whole)]
+            dbcrows = list(DirichletBC(self.W2.sub(0), Constant(0.), boundary_whole).get_boundary_values().keys())
+            dbccols = list(DirichletBC(self.W1.sub(0), Constant((0.,0.)), boundary_whole).get_boundary_values().keys())
+            self.rows = np.setdiff1d(self.rows,dbcrows)
+            self.cols = np.setdiff1d(self.cols,dbccols)
         else:
             (self.a,self.L) = self.set_problem(self.W1,self.W2,self.f,self.fh1)
-        self.assigner = FunctionAssigner(self.W2, [self.F0,  self.F2, self.FPH1])
+        if (len(self.rows) != len(self.cols)):
+            raise RuntimeError("The restricted system has {} equations for {} unknowns : the domain has {} harmonic 1-forms while {} are used, set search_harmonics=True (or check expected_harmonics)".format(
+                len(self.rows),len(self.cols),len(self.cols) - len(self.rows) + self.n1,self.n1))
+        print("Unknowns : {}".format(len(self.cols)))
         self.fa0 = Function(self.F0)
         self.fa2 = Function(self.F2)
-        self.fah1 = Function(self.FPH1)
+        self.fah1 = None
+        if (self.n1 > 0):
+            self.assigner = FunctionAssigner(self.W2, [self.F0,  self.F2, self.FPH1])
+            self.fah1 = Function(self.FPH1)
+        else:
+            self.assigner = FunctionAssigner(self.W2, [self.F0,  self.F2])
+        self.A = None
+        self.lu = None
         
     def interpolate(self):
         self.fa0.interpolate(self.fe0)
         self.fa2.interpolate(self.fe2)
-        self.assigner.assign(self.f, [self.fa0,  self.fa2,  self.fah1])
+        if (self.n1 > 0):
+            self.assigner.assign(self.f, [self.fa0,  self.fa2,  self.fah1])
+        else:
+            self.assigner.assign(self.f, [self.fa0,  self.fa2])
     
     def set_harmonic_basis(self,u):
         for i in range(self.n1):
             self.fh1[i].assign(u[i])
     
+    def factorize(self):
+        mat = as_backend_type(assemble(self.a)).mat()
+        csr = as_operator(mat).csr()
+        self.A = csr[self.rows][:,self.cols].tocsc()
+        self.lu = splu(self.A,permc_spec='MMD_AT_PLUS_A')
+    
     def solve(self):
+        if self.lu is None:
+            self.factorize()
+        b = assemble(self.L).get_local()[self.rows]
+        x = self.lu.solve(b)
         usol = Function(self.W1)
-        solve(self.a == self.L,usol,self.dbc)
+        values = np.zeros(self.W1.dim())
+        values[self.cols] = x
+        usol.vector().set_local(values)
+        usol.vector().apply("insert")
         return usol
     
     def solve_1_form_dual(self):
-        usol = Function(self.W1)
-        solve(self.a == self.L,usol,self.dbc)
+        usol = self.solve()
         B = project(as_vector((usol.sub(0)[1],-usol.sub(0)[0])), self.F1)
         return B
         
     def set_problem(self,W1,W2,f,fh1):
         (u_1,u_p) = TrialFunctions(W1)
-        (v_0,v_2,v_q1) = TestFunctions(W2)
-        (f_0,f_2,f_h1) = split(f)
+        if (self.n1 >0):
+            (v_0,v_2,v_q1) = TestFunctions(W2)
+            (f_0,f_2,f_h1) = split(f)
+        else:
+            (v_0,v_2) = TestFunctions(W2)
+            (f_0,f_2) = split(f)
         a1 = (u_1[1].dx(0) - u_1[0].dx(1))*v_2*dx
         a2 = v_0.dx(0)*u_1[0]*dx + v_0.dx(1)*u_1[1]*dx
         ah = u_p*v_0*dx 
@@ -291,8 +602,12 @@ class BiotSavart_harmonic_restrict:
     
     def set_problem_DBC(self,W1,W2,f,fh1):
         (u_1,u_p) = TrialFunctions(W1)
-        (v_0,v_2,v_q1) = TestFunctions(W2)
-        (f_0,f_2,f_h1) = split(f)
+        if (self.n1 >0):
+            (v_0,v_2,v_q1) = TestFunctions(W2)
+            (f_0,f_2,f_h1) = split(f)
+        else:
+            (v_0,v_2) = TestFunctions(W2)
+            (f_0,f_2) = split(f)
         a1 = (u_1[1].dx(0) - u_1[0].dx(1))*v_2*dx
         a2 = v_0.dx(0)*u_1[0]*dx + v_0.dx(1)*u_1[1]*dx
         ah = u_p*v_2*dx 
@@ -305,8 +620,10 @@ class BiotSavart_harmonic_restrict:
 class BiotSavart_base:
     def __init__(self,DBC=False,Elemdict = {
         '0f' : {'form' : 'trimmed', 'degree' : 1}, '1f' : {'form' : 'trimmed', 'degree' : 1}, 
-        '2f' : {'form' : 'trimmed', 'degree' : 1}}):
+        '2f' : {'form' : 'trimmed', 'degree' : 1}},Tunning={}):
         
+        self.Elemdict = Elemdict
+        self.Tunning = Tunning
         if (Elemdict['0f']['form'] == 'trimmed'):
             self.Elemf0 = FiniteElement('P-', cell='triangle', degree=Elemdict['0f']['degree'], form_degree=0)
         elif (Elemdict['0f']['form'] == 'full'):
@@ -332,184 +649,139 @@ class BiotSavart_base:
         self.fe2 = Expression("0", degree=2)
         self.DBC = DBC
         
-    def init(self,mesh):
+    def init(self,mesh,context=None):
         self.mesh = mesh
-        self.W = FunctionSpace(self.mesh, self.TH)
-        self.F0 = FunctionSpace(self.mesh,self.Elemf0)
-        self.F1 = FunctionSpace(self.mesh,self.Elemf1)
-        self.F2 = FunctionSpace(self.mesh,self.Elemf2)
-        self.FPH = FunctionSpace(self.mesh,self.PH)
+        if context is not None:
+            context.set_spaces(self)
+        else:
+            self.set_spaces()
         self.f = Function(self.W)
-        if (self.DBC):
+        if ("assembly" in self.Tunning) and (self.Tunning["assembly"] == "DEC") and DEC_applicable(self.Elemdict):
+            A = assemble_DEC(self.W,self.mesh,[],self.DBC)
+        elif context is not None:
+            A = context.assemble(self,('base',))
+        elif (self.DBC):
             a, L = self.set_problem_DBC(self.W)
-            A, b = assemble_system(a,L,[DirichletBC(self.W.sub(0), Constant(0.), boundary_whole),
-                                           DirichletBC(self.W.sub(1), Constant((0.,0.)), boundary_whole)])
+            A, b = assemble_system(a,L,self.get_dbc())
             return A
         else:
             a, L = self.set_problem(self.W)
             return assemble(a)
-        
-    def set_problem(self,W):
+        if (self.DBC):
+            # same as assemble_system : the boundary rows and columns are replaced by the identity
+            dofs = []
+            for bc in self.get_dbc():
+                dofs += list(bc.get_boundary_values().keys())
+            as_backend_type(A).mat().zeroRowsColumns(np.array(dofs,dtype=PETSc.IntType),diag=1.)
+        return A
+    
+    def set_spaces(self,space=None):
+        if space is None:
+            space = lambda element : FunctionSpace(self.mesh,element)
+        self.W = space(self.TH)
+        self.F0 = space(self.Elemf0)
+        self.F1 = space(self.Elemf1)
+        self.F2 = space(self.Elemf2)
+        self.FPH = space(self.PH)
+    
+    def get_dbc(self):
+        return [DirichletBC(self.W.sub(0), Constant(0.), boundary_whole),
+                                           DirichletBC(self.W.sub(1), Constant((0.,0.)), boundary_whole)]
+    
+    def set_derivative(self,W):
         (u_0,u_1,u_2,u_p) = TrialFunctions(W)
         (v_0,v_1,v_2,v_q) = TestFunctions(W)
         a1 = u_0.dx(0)*v_1[0]*dx + u_0.dx(1)*v_1[1]*dx + (u_1[1].dx(0) - u_1[0].dx(1))*v_2*dx
         a2 = v_0.dx(0)*u_1[0]*dx + v_0.dx(1)*u_1[1]*dx + (v_1[1].dx(0) - v_1[0].dx(1))*u_2*dx
-        ah = u_p*v_0*dx + u_0*v_q*dx
-        a = a1 + a2 + ah
+        return a1 + a2
+    
+    def set_coupling(self,W,fh1,DBC):
+        (u_0,u_1,u_2,u_p) = TrialFunctions(W)
+        (v_0,v_1,v_2,v_q) = TestFunctions(W)
+        if (DBC):
+            return u_p*v_2*dx + u_2*v_q*dx
+        else:
+            return u_p*v_0*dx + u_0*v_q*dx
+        
+    def set_problem(self,W):
+        (v_0,v_1,v_2,v_q) = TestFunctions(W)
+        a = self.set_derivative(W) + self.set_coupling(W,[],False)
         L = Constant(0.)*v_q*dx
         return (a,L)
     
     def set_problem_DBC(self,W):
-        (u_0,u_1,u_2,u_p) = TrialFunctions(W)
         (v_0,v_1,v_2,v_q) = TestFunctions(W)
-        a1 = u_0.dx(0)*v_1[0]*dx + u_0.dx(1)*v_1[1]*dx + (u_1[1].dx(0) - u_1[0].dx(1))*v_2*dx
-        a2 = v_0.dx(0)*u_1[0]*dx + v_0.dx(1)*u_1[1]*dx + (v_1[1].dx(0) - v_1[0].dx(1))*u_2*dx
-        ah = u_p*v_2*dx + u_2*v_q*dx
-        a = a1 + a2 + ah
+        a = self.set_derivative(W) + self.set_coupling(W,[],True)
         L = Constant(0.)*v_q*dx
         return (a,L)
 
+def harmonic_seeds(biot_savart_solver,fh1):
+    """
+    Vectors of the mixed space of the search holding the harmonic forms fh1 (the other blocks are 0), used to start the inverse iteration.
+    """
+    assigner = FunctionAssigner(biot_savart_solver.W.sub(1),biot_savart_solver.F1)
+    u = Function(biot_savart_solver.W)
+    X = np.zeros((biot_savart_solver.W.dim(),len(fh1)))
+    for i in range(len(fh1)):
+        u.vector().zero()
+        assigner.assign(u.sub(1),fh1[i])
+        X[:,i] = u.vector().get_local()
+    return X
 
+def get_harmonic1_basis(mesh,Lu1,DBC=False,Elemdict=None,Tunning={},expected_harmonics=2,printvp=False,customthreshold=1e-15,context=None):
+    if ("p_multilevel" in Tunning) and (Tunning["p_multilevel"]) and (Elemdict is not None) and (Elemdict != lowest_order_elements(Elemdict)):
+        return get_harmonic1_basis_multilevel(mesh,Lu1,DBC=DBC,Elemdict=Elemdict,Tunning=Tunning,expected_harmonics=expected_harmonics,
+                                  printvp=printvp,customthreshold=customthreshold,context=context)
+    before = peak_memory()
+    (biot_savart_solver,operator) = assemble_harmonic_search(BiotSavart_base,mesh,DBC=DBC,Elemdict=Elemdict,Tunning=Tunning,context=context)
+    Solver = null_space_solver(operator,Tunning=Tunning,expected_harmonics=expected_harmonics,
+                               printvp=printvp,customthreshold=customthreshold)
+    n = extract_harmonic1_basis(biot_savart_solver,Solver,Lu1,expected_harmonics)
+    if ("memory_report" in Tunning) and (Tunning["memory_report"]):
+        print("Peak memory : {:.1f} MB before the search, {:.1f} MB after".format(before,peak_memory()))
+    return n
 
-from petsc4py import PETSc
-from slepc4py import SLEPc
-class SVD_null_space_solver:
-    def __init__(self,mat,Tunning={},expected_harmonics=2,printvp=False,customthreshold=1e-15):
-        self.vr = PETSc.Vec().create()
-        self.vr.setSizes(mat.size[0])
-        self.vr.setFromOptions()
-        self.vl = PETSc.Vec().create()
-        self.vl.setSizes(mat.size[0])
-        self.vl.setFromOptions()
-        
-        self.S = SLEPc.SVD(); self.S.create()
-        self.S.setOperator(mat)
-        self.S.setWhichSingularTriplets(SLEPc.SVD.Which.SMALLEST)
-        if ("max_auto_ncv" in Tunning):
-            max_auto_ncv = Tunning["max_auto_ncv"]
-        else:
-            max_auto_ncv = 200
-        
-        if ("ncv" in Tunning) and (Tunning["ncv"] > 0) and ("mpd" in Tunning) and (Tunning["mpd"] > 0):
-            print("Using custom value : {} {}".format(Tunning["ncv"],Tunning["mpd"]))
-            self.S.setDimensions(expected_harmonics,Tunning["ncv"],Tunning["mpd"])
-            try:
-                self.S.solve()
-            except Exception as e:
-                print("Exeption encountered while solving :" + str(e) + " \n Giving up (auto increase does not apply with user supplied parameter ncv and mpd")
-                raise
-            self.numberconverged = self.S.getConverged()
-        else:
-            nsv = expected_harmonics
-            ncv = max(16,nsv*2)
-            #mpd =
-            self.S.setDimensions(nsv,ncv,ncv)
-            try:
-                self.S.solve()
-            except Exception as e:
-                self.numberconverged = 0
-                print("Exeption encountered while solving :" + str(e) + " \n Trying with higher ncv and mpd")
-            else:
-                self.numberconverged = self.S.getConverged()
-            # will raise an error when ncv get too big
-            while((self.numberconverged < expected_harmonics) and (ncv < max_auto_ncv)):
-                ncv += 10
-                self.S.setDimensions(nsv,ncv,ncv)
-                try:
-                    self.S.solve()
-                except Exception as e:
-                    self.numberconverged = 0
-                    print("Exeption encountered while solving :" + str(e) + " \n Trying with higher ncv and mpd")
-                    if (ncv >= max_auto_ncv):
-                        raise RuntimeError('ncv reached max_auto_ncv without finding enough harmonics and the last try raised an error in the solver. Giving up as it would be left in an unstable state')
-                else:
-                    self.numberconverged = self.S.getConverged()
-        self.n = 0
-        for i in range(self.numberconverged):
-            if (printvp):
-                print(self.S.getSingularTriplet(i))
-            if (self.S.getSingularTriplet(i) < customthreshold):
-                self.n += 1
-    def Get_Dim(self):
-        return self.n
-    def Get_Vector(self,i):
-        self.S.getSingularTriplet(i,self.vl,self.vr)
-        return self.vr.getArray()
-
-# Not tested wet
-from scipy.sparse import csr_matrix
-from sparseqr import qr
-class SuiteSparseQR_solver:
-    def __init__(self,mat,Tunning={},expected_harmonics=2,printvp=False,customthreshold=1e-15):
-        csr = csr_matrix(mat.getValuesCSR()[::-1], shape=mat.size)
-        # mat = csr.transpose().tocoo() # optionnal, doc of sparseqr specify that coo is the optimal input format
-        Q, R, E, rank = qr( csr.transpose())
-        max_rank = max(expected_harmonics,rank) + 1
-        self.n = 0
-        for i in range(1,max_rank):
-            if(printvp):
-                print(R[-i])
-            if(R[-i] < customthreshold):
-                self.n += 1
-        if(printvp):
-            print("Next value would be : {}\n".format(R[-max_rank]))
-        self.N = Q.tocsc()[:,rank:]
-    def Get_Dim(self):
-        return self.n
-    def Get_Vector(self,i):
-        return N[:,i].todense()
+def get_harmonic1_basis_multilevel(mesh,Lu1,DBC=False,Elemdict=None,Tunning={},expected_harmonics=2,printvp=False,customthreshold=1e-15,context=None):
+    """
+    p-multilevel search : the dimension of the harmonic space does not depend on the degree, the basis is searched with the lowest order elements
+    (trimmed of degree 1, DEC assembly is used when requested), interpolated in the F1 of Elemdict and polished on the operator of the search by polish_harmonic_basis
+    (preconditioned LOBPCG by default, Tunning["p_multilevel_steps"] (default 3) steps of inverse iteration with Tunning["polish"] == "lu").
+    """
+    Lu1_low = []
+    # no context : the derivative blocks of the two degrees must not be mixed
+    n = get_harmonic1_basis(mesh,Lu1_low,DBC=DBC,Elemdict=lowest_order_elements(Elemdict),Tunning=Tunning,expected_harmonics=expected_harmonics,
+                            printvp=printvp,customthreshold=customthreshold)
+    if (n == 0):
+        return 0
+    (biot_savart_solver,operator) = assemble_harmonic_search(BiotSavart_base,mesh,DBC=DBC,Elemdict=Elemdict,Tunning=Tunning,context=context)
+    X = harmonic_seeds(biot_savart_solver,[interpolate(u,biot_savart_solver.F1) for u in Lu1_low])
+    if ("p_multilevel_steps" in Tunning):
+        steps = Tunning["p_multilevel_steps"]
+    else:
+        steps = 3
+    Solver = polish_harmonic_basis(operator,X,Tunning=Tunning,steps=steps)
+    return extract_harmonic1_basis(biot_savart_solver,Solver,Lu1,expected_harmonics)
 
-# Tested in 3D, should not be different here
-from scipy.sparse.linalg import eigs
-class Scipy_eigs_solver:
-    def __init__(self,mat,Tunning={},expected_harmonics=2,printvp=False,customthreshold=1e-15):
-        csr = csr_matrix(mat.getValuesCSR()[::-1], shape=mat.size)
-        sigma=-1e-1
-        if ("eigs_tol" in Tunning):
-            tol = Tunning["eigs_tol"]
-        else:
-            tol = 1e-6
-        eigenvalues,eigenvectors = eigs(csr.transpose().dot(csr),k=expected_harmonics,
-                                        sigma=sigma,which='LM',tol=tol,return_eigenvectors=True)
-        # result is complex by default
-        self.eigenvalues = np.real(eigenvalues)
-        self.eigenvectors = np.real(eigenvectors)
-        
-        max_rank = max(expected_harmonics,len(self.eigenvalues))
-        self.n = 0
-        for i in range(max_rank):
-            if(printvp):
-                print(self.eigenvalues[i])
-            if(self.eigenvalues[i] < customthreshold):
-                self.n += 1
-    def Get_Dim(self):
-        return self.n
-    def Get_Vector(self,i):
-        return self.eigenvectors[:,i]
+def transfer_harmonic1_basis(mesh,fh1,Lu1,DBC=False,Elemdict=None,Tunning={},context=None):
+    """
+    The dimension of the harmonic space does not depend on the refinement : the basis fh1 found on a parent mesh is interpolated in the F1 of mesh
+    and polished on the operator of the search (see polish_harmonic_basis) instead of searching again.
+    """
+    if (len(fh1) == 0):
+        return 0
+    (biot_savart_solver,operator) = assemble_harmonic_search(BiotSavart_base,mesh,DBC=DBC,Elemdict=Elemdict,Tunning=Tunning,context=context)
+    lifted = []
+    for u in fh1:
+        u.set_allow_extrapolation(True) # the new boundary vertices may be slightly outside of the parent mesh
+        lifted.append(interpolate(u,biot_savart_solver.F1))
+    Solver = polish_harmonic_basis(operator,harmonic_seeds(biot_savart_solver,lifted),Tunning=Tunning)
+    return extract_harmonic1_basis(biot_savart_solver,Solver,Lu1,len(fh1))
 
-def get_harmonic1_basis(mesh,Lu1,DBC=False,Elemdict=None,Tunning={},expected_harmonics=2,printvp=False,customthreshold=1e-15):
-    if Elemdict is not None:
-        biot_savart_solver = BiotSavart_base(DBC,Elemdict=Elemdict)
-    else:
-        biot_savart_solver = BiotSavart_base(DBC)
-    A = biot_savart_solver.init(mesh)
-    print("system size : ",np.shape(A.array()))
-    mat = as_backend_type(A).mat()
-    if ("solver" in Tunning) and (Tunning["solver"] == "SLEPc_SVD"):
-        Solver = SVD_null_space_solver(mat,Tunning=Tunning,expected_harmonics=expected_harmonics,
-                                       printvp=printvp,customthreshold=customthreshold)
-    elif ("solver" in Tunning) and (Tunning["solver"] == "SuiteSparse_QR"):
-        Solver = SuiteSparseQR_solver(mat,Tunning=Tunning,expected_harmonics=expected_harmonics,
-                                       printvp=printvp,customthreshold=customthreshold)
-    elif ("solver" in Tunning) and (Tunning["solver"] == "Scipy_eigs"):
-        Solver = Scipy_eigs_solver(mat,Tunning=Tunning,expected_harmonics=expected_harmonics,
-                                       printvp=printvp,customthreshold=customthreshold)
-    else:
-        Solver = Scipy_eigs_solver(mat,Tunning=Tunning,expected_harmonics=expected_harmonics,
-                                       printvp=printvp,customthreshold=customthreshold)
-    
+def extract_harmonic1_basis(biot_savart_solver,Solver,Lu1,expected_harmonics=2):
     n = Solver.Get_Dim()
     print("Found ",n," element in the basis")
+    if Solver.Get_Confidence() is not None:
+        print("Spectral gap after the null space : {} decades".format(Solver.Get_Confidence()))
     if (n != expected_harmonics):
         print("Warning : found {} harmonics while {} were expected.".format(n,expected_harmonics))
         print("The number of expected harmonics default to 2, ignore this if less were expected")
@@ -522,7 +794,7 @@ def get_harmonic1_basis(mesh,Lu1,DBC=False,Elemdict=None,Tunning={},expected_har
     uharmFP1 = Function(biot_savart_solver.F1)
     for i in range(n):
         Lu1.append(Function(biot_savart_solver.F1))
-        uharmfull.vector().set_local(Solver.Get_Vector(i))
+        Solver.Get_Vector(i,uharmfull.vector())
         # uharmFP1.assign((uharmfull.split(True))[1]) # split(True) necessary? # check bug
         assigner.assign(uharmFP1,uharmfull.sub(1))
         uharmFP1tmp = uharmFP1
@@ -564,5 +836,31 @@ def get_harmonic1_basis_legacy(mesh,Lu1,DBC=False,printvp=False,customthreshold=
         Lu1[i].assign(uharmFP1)
     return n
     
-def boundary_whole(x, on_boundary):
-    return on_boundary
+def adaptive_solve(solver,mesh,tol,theta=0.5,max_levels=10,search_harmonics=False,expected_harmonics=2,printvp=False,customthreshold=1e-15):
+    """
+    Solve and locally refine the mesh (Dorfler marking with parameter theta) until the estimated error is below tol or max_levels meshes have been used.
+    solver is a BiotSavart_harmonic with fe0, fe1 and fe2 already set, it is re-initialised on each new mesh.
+    The dimension of the harmonic space does not depend on the refinement : the harmonics are searched on the first mesh only, the basis is then carried
+    to the refined meshes (interpolated and polished, see init_mesh_transfer) and the search is disabled once it is found to be 0.
+    Return (usol,history) where history hold [number of cells, dimension of W, estimated error] for each level.
+    """
+    history = []
+    for level in range(max_levels):
+        if (level > 0) and (search_harmonics):
+            solver.init_mesh_transfer(mesh,solver.fh1)
+        else:
+            solver.init_mesh(mesh,search_harmonics=search_harmonics,expected_harmonics=expected_harmonics,
+                             printvp=printvp,customthreshold=customthreshold)
+        solver.interpolate()
+        usol = solver.solve()
+        eta = solver.estimate_error(usol)
+        estimate = np.sqrt(np.sum(eta))
+        history.append([mesh.num_cells(),solver.W.dim(),estimate])
+        print("Level {} : {} cells, {} dofs, estimated error {}".format(level,mesh.num_cells(),solver.W.dim(),estimate))
+        if (estimate < tol):
+            break
+        if (search_harmonics):
+            search_harmonics = (solver.n1 > 0)
+        if (level < max_levels - 1):
+            mesh = refine(mesh,dorfler_marking(mesh,eta,theta))
+    return (usol,history)
@@ -0,0 +1,126 @@
+from dolfin import *
+import numpy as np
+import os
+from collections import OrderedDict
+
+def zero_like(e):
+    if (len(e.ufl_shape) == 0):
+        return Constant(0.)
+    return Constant(tuple([0.]*e.ufl_shape[0]))
+
+class Superposition_cache:
+    """
+    Store the responses of a BiotSavart_harmonic (2D or 3D) to a set of registered basis sources,
+    any linear combination of these sources is then evaluated by a dense mat-vec over the stored dof arrays instead of a new solve.
+    The solver must be initialised with init_mesh() before registering. init_mesh() and update_coordinates() of the solver call invalidate() :
+    the responses are dropped (and their files deleted) and recomputed from the registered sources when they are needed.
+    register(key,sources) take a dictionary of the form {'fe0' : Expression, 'fe2' : Expression}, source terms which are not given are set to 0.
+    Registering modify solver.f, call interpolate() on the solver before using solve() again.
+    memory_budget (in bytes) bound the size of the responses kept in memory, the least recently used are evicted when it is exceeded.
+        Evicted responses are recomputed when needed, or mapped again from disk when directory is set.
+    When directory is set, each response is written once in this directory as a .npy file and read memory-mapped.
+    combine(coeffs) return the dof array(s) of the combination, coeffs is either a dictionary {key : coefficient},
+        an array of coefficients ordered as keys() or a 2D array (one combination per row).
+    solve_combination(coeffs) return the combination as a function in the mixed space (as solve()).
+    """
+    def __init__(self,solver,memory_budget=None,directory=None):
+        self.solver = solver
+        self.memory_budget = memory_budget
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory,exist_ok=True)
+        self.fe_names = [name for name in ('fe0','fe1','fe2','fe3') if hasattr(solver,name)]
+        self.size = solver.W.dim()
+        self.sources = OrderedDict()
+        self.files = {}
+        self.responses = OrderedDict() # in memory responses, least recently used first
+        self.memory = 0
+
+    def keys(self):
+        return list(self.sources.keys())
+
+    def register(self,key,sources):
+        self.sources[key] = sources
+        self.update(key)
+
+    def update(self,key):
+        response = self.compute(self.sources[key])
+        if self.directory is not None:
+            if key not in self.files:
+                self.files[key] = os.path.join(self.directory,"response_{}.npy".format(len(self.files)))
+            np.save(self.files[key],response)
+            response = np.load(self.files[key],mmap_mode='r')
+        self.store(key,response)
+        return response
+
+    def invalidate(self):
+        """
+        Drop all the responses, the registered sources are kept.
+        """
+        for path in self.files.values():
+            if os.path.exists(path):
+                os.remove(path)
+        self.files = {}
+        self.responses = OrderedDict()
+        self.memory = 0
+        self.size = self.solver.W.dim()
+
+    def compute(self,sources):
+        saved = {}
+        for name in self.fe_names:
+            saved[name] = getattr(self.solver,name)
+            if name in sources:
+                setattr(self.solver,name,sources[name])
+            else:
+                setattr(self.solver,name,zero_like(saved[name]))
+        try:
+            self.solver.interpolate()
+            usol = self.solver.solve()
+        finally:
+            for name in saved:
+                setattr(self.solver,name,saved[name])
+        return usol.vector().get_local()
+
+    def store(self,key,response):
+        if key in self.responses:
+            self.memory -= self.responses.pop(key).nbytes
+        self.responses[key] = response
+        self.memory += response.nbytes
+        while (self.memory_budget is not None) and (self.memory > self.memory_budget) and (len(self.responses) > 1):
+            (evicted,array) = self.responses.popitem(last=False)
+            self.memory -= array.nbytes
+
+    def get_response(self,key):
+        if key in self.responses:
+            self.responses.move_to_end(key)
+            return self.responses[key]
+        if key in self.files:
+            response = np.load(self.files[key],mmap_mode='r')
+            self.store(key,response)
+            return response
+        return self.update(key)
+
+    def combine(self,coeffs):
+        if isinstance(coeffs,dict):
+            keys = list(coeffs.keys())
+            C = np.array([coeffs[key] for key in keys],dtype=float)
+        else:
+            keys = self.keys()
+            C = np.asarray(coeffs,dtype=float)
+        single = (C.ndim == 1)
+        C = np.atleast_2d(C)
+        if (C.shape[1] != len(keys)):
+            raise ValueError("Expected {} coefficients, got {}".format(len(keys),C.shape[1]))
+        # Accumulate column by column so that only the responses in use need to be held in memory
+        x = np.zeros((C.shape[0],self.size))
+        for j in range(len(keys)):
+            x += np.outer(C[:,j],self.get_response(keys[j]))
+        if single:
+            return x[0]
+        return x
+
+    def solve_combination(self,coeffs):
+        usol = Function(self.solver.W)
+        usol.vector().set_local(self.combine(coeffs))
+        usol.vector().apply("insert")
+        return usol